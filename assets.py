@@ -0,0 +1,72 @@
+# assets.py - сборка статики: отпечатки в именах файлов и предсжатые копии
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен, без него собираем только .gz
+    brotli = None
+
+DIST_DIR = 'dist'
+MANIFEST_FILE = 'manifest.json'
+# Типы, которые имеет смысл сжимать (png/jpg уже сжаты)
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.json', '.txt', '.html', '.map', '.xml'}
+
+
+def _fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def build_assets(static_dir='static'):
+    """Копирует статику в static/dist с хэшем в имени и пишет manifest.json"""
+    dist = os.path.join(static_dir, DIST_DIR)
+    shutil.rmtree(dist, ignore_errors=True)
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_dir):
+        if os.path.abspath(root) == os.path.abspath(static_dir) and DIST_DIR in dirs:
+            dirs.remove(DIST_DIR)
+        for name in files:
+            src = os.path.join(root, name)
+            rel = os.path.relpath(src, static_dir).replace(os.sep, '/')
+            stem, ext = os.path.splitext(rel)
+            fingerprinted = f'{stem}.{_fingerprint(src)}{ext}'
+            dst = os.path.join(dist, fingerprinted)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(src, dst)
+
+            if ext.lower() in COMPRESSIBLE:
+                with open(src, 'rb') as f:
+                    data = f.read()
+                with open(f'{dst}.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    with open(f'{dst}.br', 'wb') as f:
+                        f.write(brotli.compress(data, quality=11))
+
+            manifest[rel] = f'{DIST_DIR}/{fingerprinted}'
+
+    with open(os.path.join(dist, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_dir='static'):
+    """Манифест собранной статики; пустой, если сборка не выполнялась"""
+    try:
+        with open(os.path.join(static_dir, DIST_DIR, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+if __name__ == '__main__':
+    built = build_assets()
+    print(f"Собрано файлов статики: {len(built)}")
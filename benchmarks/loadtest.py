@@ -0,0 +1,213 @@
+"""Нагрузочный тест веб-приложения под waitress на синтетической базе.
+
+Пример:
+    python -m benchmarks.seed --db db/bench_GreenAtom.db --users 100000
+    python -m benchmarks.loadtest --db db/bench_GreenAtom.db --concurrency 16 --requests 2000 \\
+        --output benchmarks/results/current.json --baseline benchmarks/results/baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.seed import BENCH_PASSWORD, bench_email
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def _request(url, data=None, cookie=None):
+    headers = {}
+    if cookie:
+        headers['Cookie'] = cookie
+    body = urllib.parse.urlencode(data).encode() if data is not None else None
+    req = urllib.request.Request(url, data=body, headers=headers)
+    try:
+        with _opener.open(req, timeout=60) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def run_scenario(name, func, requests, concurrency):
+    """Выполняет func(i) requests раз в concurrency потоков и собирает задержки"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def task(i):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = func(i)
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(task, range(requests)))
+    duration = time.perf_counter() - started
+
+    result = {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'duration_s': round(duration, 3),
+        'throughput_rps': round(requests / duration, 2) if duration else 0,
+        'latency_ms': {
+            'mean': round(statistics.mean(latencies) * 1000, 2) if latencies else 0,
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'max': round(max(latencies) * 1000, 2) if latencies else 0
+        }
+    }
+    print(f"{name:<22} {result['throughput_rps']:>9.1f} rps  "
+          f"p50 {result['latency_ms']['p50']:>8.2f} ms  p95 {result['latency_ms']['p95']:>8.2f} ms  "
+          f"p99 {result['latency_ms']['p99']:>8.2f} ms  errors {errors}")
+    return result
+
+
+def live_tokens(db_path, limit):
+    con = sqlite3.connect(db_path)
+    try:
+        rows = con.execute(
+            'SELECT token FROM auth_tokens WHERE expires_at > ? LIMIT ?',
+            (datetime.datetime.now().isoformat(' '), limit)
+        ).fetchall()
+    finally:
+        con.close()
+    return [row[0] for row in rows]
+
+
+def start_server(db_path, port, threads):
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(db_path)}'
+    os.environ['WAITRESS_THREADS'] = str(threads)
+    os.environ.setdefault('DEBUG', 'False')
+
+    import main
+    from waitress.server import create_server
+
+    main.app.config['WTF_CSRF_ENABLED'] = False
+    main.create_app(start_scheduler=False)
+    server = create_server(main.app, host='127.0.0.1', port=port, threads=threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    return main, server
+
+
+def compare(current, baseline):
+    print('\nСравнение с базовой линией (throughput, p95):')
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        rps = (result['throughput_rps'] / base['throughput_rps'] - 1) * 100 if base['throughput_rps'] else 0
+        p95 = (result['latency_ms']['p95'] / base['latency_ms']['p95'] - 1) * 100 if base['latency_ms']['p95'] else 0
+        print(f'{name:<22} rps {rps:+7.1f}%  p95 {p95:+7.1f}%')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест GreenAtom')
+    parser.add_argument('--db', default='db/bench_GreenAtom.db')
+    parser.add_argument('--users', type=int, default=100000, help='сколько пользователей засеяно')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--threads', type=int, default=8, help='потоков waitress')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=1000, help='запросов на сценарий')
+    parser.add_argument('--collect-runs', type=int, default=20, help='вызовов MetricsCollector.collect_all')
+    parser.add_argument('--output', help='куда сохранить JSON с результатами')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    args = parser.parse_args()
+
+    app_module, server = start_server(args.db, args.port, args.threads)
+    base_url = f'http://127.0.0.1:{args.port}'
+    tokens = live_tokens(args.db, args.requests)
+    if not tokens:
+        raise SystemExit('В базе нет действующих токенов - засейте ее через benchmarks.seed')
+    rnd = random.Random(1)
+
+    def login(i):
+        email = bench_email(rnd.randrange(args.users))
+        return _request(f'{base_url}/login', {'email': email, 'password': BENCH_PASSWORD}) == 302
+
+    def token_page(i):
+        return _request(f'{base_url}/waste-calculator', cookie=f'auth_token={tokens[i % len(tokens)]}') == 200
+
+    def calculate(i):
+        data = {'waste_class': rnd.choice(('1', '2')), 'waste_volume': f'{rnd.uniform(0.1, 20):.2f}'}
+        return _request(f'{base_url}/waste-calculator', data, cookie=f'auth_token={tokens[i % len(tokens)]}') == 200
+
+    def collect(i):
+        from data import db_session
+        from metrics.collector import MetricsCollector
+        db_sess = db_session.create_session()
+        try:
+            MetricsCollector.collect_all(db_sess)
+            return True
+        finally:
+            db_sess.close()
+
+    scenarios = {
+        'login': run_scenario('login', login, args.requests, args.concurrency),
+        'token_cookie_get': run_scenario('token_cookie_get', token_page, args.requests, args.concurrency),
+        'waste_calculator_post': run_scenario('waste_calculator_post', calculate, args.requests, args.concurrency),
+        'metrics_collect_all': run_scenario('metrics_collect_all', collect, args.collect_runs,
+                                            min(args.concurrency, 4)),
+    }
+    server.close()
+
+    report = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'db': args.db,
+            'waitress_threads': args.threads
+        },
+        'scenarios': scenarios
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Заполнение базы синтетическими данными для нагрузочных тестов.
+
+Пример:
+    python -m benchmarks.seed --db db/bench_GreenAtom.db --users 100000 --history 50 --tokens 2000000
+"""
+import argparse
+import datetime
+import os
+import random
+import secrets
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlalchemy
+from werkzeug.security import generate_password_hash
+
+from data import db_session
+from data.passwords import PASSWORD_HASH_METHOD
+from data.users import User, AuthToken, RememberToken
+from data.calculations import Calculation
+from data.rollups import CalculationRollup, PERIODS, ALL_CLASSES, bucket_start
+
+BENCH_PASSWORD = 'benchmark'
+RATES = {'1': 222907.36, '2': 62468.26}
+
+
+def bench_email(i):
+    return f'bench{i}@example.com'
+
+
+def _chunks(total, size):
+    for start in range(0, total, size):
+        yield start, min(start + size, total)
+
+
+def seed(db_path, users, history, tokens, days, chunk_size, seed_value):
+    rnd = random.Random(seed_value)
+    if os.path.exists(db_path):
+        raise SystemExit(f'{db_path} уже существует - укажите новый файл')
+
+    os.environ.pop('DATABASE_URL', None)
+    db_session.global_init(db_path)
+    db_sess = db_session.create_write_session()
+
+    now = datetime.datetime.now()
+    # хэш один на всех: хэширование 100k паролей заняло бы часы
+    hashed_password = generate_password_hash(BENCH_PASSWORD, PASSWORD_HASH_METHOD)
+    rollups = {}
+    started = time.perf_counter()
+
+    try:
+        for lo, hi in _chunks(users, chunk_size):
+            db_sess.execute(sqlalchemy.insert(User), [
+                {
+                    'id': i + 1,
+                    'email': bench_email(i),
+                    'name': f'Bench {i}',
+                    'hashed_password': hashed_password,
+                    'login_time': now - datetime.timedelta(minutes=rnd.randrange(days * 1440)),
+                    'price_history': ''
+                }
+                for i in range(lo, hi)
+            ])
+
+            calculations = []
+            for user_id in range(lo + 1, hi + 1):
+                for _ in range(history):
+                    waste_class = rnd.choice(('1', '2'))
+                    volume = round(rnd.uniform(0.1, 20), 2)
+                    price = round(RATES[waste_class] * volume, 2)
+                    created_at = now - datetime.timedelta(seconds=rnd.randrange(days * 86400))
+                    calculations.append({
+                        'user_id': user_id,
+                        'price': price,
+                        'waste_class': waste_class,
+                        'volume': volume,
+                        'created_at': created_at
+                    })
+                    for period in PERIODS:
+                        start = bucket_start(created_at, period)
+                        for cls in (ALL_CLASSES, waste_class):
+                            count, s, sq, vol = rollups.get((period, start, cls), (0, 0.0, 0.0, 0.0))
+                            rollups[(period, start, cls)] = (count + 1, s + price, sq + price * price, vol + volume)
+            if calculations:
+                db_sess.execute(sqlalchemy.insert(Calculation), calculations)
+            db_sess.commit()
+            print(f'users {hi}/{users} ({time.perf_counter() - started:.1f}s)')
+
+        for lo, hi in _chunks(tokens, chunk_size):
+            auth_rows, remember_rows = [], []
+            for _ in range(lo, hi):
+                row = {
+                    'user_id': rnd.randrange(users) + 1,
+                    'token': secrets.token_urlsafe(64),
+                    'created_at': now - datetime.timedelta(days=rnd.uniform(0, days)),
+                    # примерно половина токенов уже просрочена
+                    'expires_at': now + datetime.timedelta(hours=rnd.uniform(-24 * days, 24))
+                }
+                (remember_rows if rnd.random() < 0.2 else auth_rows).append(row)
+            if auth_rows:
+                db_sess.execute(sqlalchemy.insert(AuthToken), auth_rows)
+            if remember_rows:
+                db_sess.execute(sqlalchemy.insert(RememberToken), remember_rows)
+            db_sess.commit()
+            print(f'tokens {hi}/{tokens} ({time.perf_counter() - started:.1f}s)')
+
+        rollup_rows = [
+            {
+                'period': period,
+                'bucket_start': start,
+                'waste_class': cls,
+                'count': count,
+                'price_sum': s,
+                'price_sumsq': sq,
+                'volume_sum': vol
+            }
+            for (period, start, cls), (count, s, sq, vol) in rollups.items()
+        ]
+        for lo, hi in _chunks(len(rollup_rows), chunk_size):
+            db_sess.execute(sqlalchemy.insert(CalculationRollup), rollup_rows[lo:hi])
+        db_sess.commit()
+    finally:
+        db_sess.close()
+
+    print(f'Готово за {time.perf_counter() - started:.1f}s: {db_path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Синтетические данные для бенчмарков')
+    parser.add_argument('--db', default='db/bench_GreenAtom.db', help='файл SQLite (не должен существовать)')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--history', type=int, default=20, help='расчетов на пользователя')
+    parser.add_argument('--tokens', type=int, default=1000000, help='auth + remember токенов всего')
+    parser.add_argument('--days', type=int, default=30, help='глубина истории в днях')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    seed(args.db, args.users, args.history, args.tokens, args.days, args.chunk_size, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,6 @@
 # импорт всех питоновских файлов
 
-from . import users
\ No newline at end of file
+from . import users
+from . import calculations
+from . import rollups
+from . import leases
@@ -0,0 +1,86 @@
+import datetime
+import sqlalchemy
+from .db_session import SqlAlchemyBase
+from sqlalchemy import orm
+from sqlalchemy_serializer import SerializerMixin
+
+
+class Calculation(SqlAlchemyBase, SerializerMixin):
+    __tablename__ = 'calculations'
+    __table_args__ = (
+        sqlalchemy.Index('ix_calculations_user_created', 'user_id', 'created_at'),
+        sqlalchemy.Index('ix_calculations_waste_class', 'waste_class'),
+    )
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    user_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey('users.id'), nullable=False)
+    price = sqlalchemy.Column(sqlalchemy.Float, nullable=False)
+    waste_class = sqlalchemy.Column(sqlalchemy.String(10), nullable=True)
+    volume = sqlalchemy.Column(sqlalchemy.Float, nullable=True)
+    created_at = sqlalchemy.Column(sqlalchemy.DateTime, default=datetime.datetime.now, nullable=False)
+
+    user = orm.relationship("User", back_populates="calculations")
+
+    def to_history_entry(self):
+        """Представление записи в формате истории цен"""
+        return {
+            'date': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'price': self.price,
+            'waste_class': self.waste_class,
+            'volume': self.volume
+        }
+
+    def __repr__(self):
+        return f'<Calculation {self.id} user={self.user_id} {self.price:.2f}>'
+
+
+def _parse_history_blob(blob):
+    """Разбор старого текстового формата истории 'дата:цена:класс:объем'"""
+    for entry in blob.split('\n'):
+        if not entry.strip():
+            continue
+        try:
+            # Дата содержит двоеточия, поэтому режем справа
+            timestamp, price, waste_class, volume = entry.rsplit(':', 3)
+            yield (
+                datetime.datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S'),
+                float(price),
+                waste_class or None,
+                float(volume) if volume else None
+            )
+        except ValueError:
+            continue
+
+
+def migrate_price_history(db_sess):
+    """Однократный перенос истории из users.price_history в таблицу calculations"""
+    from .users import User
+    from .rollups import record_calculation
+
+    users = db_sess.query(User).filter(
+        User.price_history.isnot(None),
+        User.price_history != ''
+    ).all()
+
+    migrated = 0
+    for user in users:
+        rows = [
+            {
+                'user_id': user.id,
+                'created_at': created_at,
+                'price': price,
+                'waste_class': waste_class,
+                'volume': volume
+            }
+            for created_at, price, waste_class, volume in _parse_history_blob(user.price_history)
+        ]
+        if rows:
+            db_sess.execute(sqlalchemy.insert(Calculation), rows)
+            for row in rows:
+                record_calculation(db_sess, row['created_at'], row['price'],
+                                   row['waste_class'], row['volume'])
+            migrated += len(rows)
+        user.price_history = ''
+
+    db_sess.commit()
+    return migrated
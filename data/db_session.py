@@ -1,5 +1,6 @@
 # импортируем нужные модули
 
+import os
 import sqlalchemy as sa
 import sqlalchemy.orm as orm
 from sqlalchemy.orm import Session
@@ -8,32 +9,145 @@ import sqlalchemy.ext.declarative as dec
 SqlAlchemyBase = dec.declarative_base()
 
 __factory = None
+__write_factory = None
+__engines = []
+
+# Настройки SQLite, применяемые к каждому новому соединению
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000)),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', -64000)),
+    'temp_store': 'MEMORY'
+}
+
+
+def _sqlite_tuning(engine, begin='BEGIN'):
+    """Навешивает PRAGMA и явное управление транзакциями на SQLite движок"""
+
+    @sa.event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        # отключаем неявные транзакции pysqlite, BEGIN выполняем сами
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    @sa.event.listens_for(engine, 'begin')
+    def on_begin(conn):
+        conn.exec_driver_sql(begin)
 
 
 # создаём базу данных с помощью orm моделей
 
-def global_init(db_file):
-    global __factory
+def global_init(db_file, pool_size=None):
+    global __factory, __write_factory, __engines
 
     if __factory:
         return
 
-    if not db_file or not db_file.strip():
-        raise Exception("Необходимо указать файл базы данных.")
-
-    conn_str = f'sqlite:///{db_file.strip()}?check_same_thread=False'
+    conn_str = os.getenv('DATABASE_URL')
+    if not conn_str:
+        if not db_file or not db_file.strip():
+            raise Exception("Необходимо указать файл базы данных.")
+        conn_str = f'sqlite:///{db_file.strip()}'
     print(f"Подключение к базе данных по адресу {conn_str}")
 
-    engine = sa.create_engine(conn_str, echo=False)
+    # пул соединений по числу рабочих потоков waitress плюс потоки планировщика
+    if pool_size is None:
+        pool_size = int(os.getenv('WAITRESS_THREADS', 4)) + 2
+
+    url = sa.engine.make_url(conn_str)
+    if url.get_backend_name() == 'sqlite':
+        engine = sa.create_engine(
+            url, echo=False,
+            connect_args={'check_same_thread': False},
+            poolclass=sa.pool.QueuePool,
+            pool_size=pool_size,
+            max_overflow=pool_size,
+            pool_pre_ping=False
+        )
+        _sqlite_tuning(engine)
+
+        # Отдельный движок с единственным соединением для записи:
+        # писатели выстраиваются в очередь пула, а в WAL режиме
+        # не блокируют читателей основного пула
+        write_engine = sa.create_engine(
+            url, echo=False,
+            connect_args={'check_same_thread': False},
+            poolclass=sa.pool.QueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=30
+        )
+        _sqlite_tuning(write_engine, begin='BEGIN IMMEDIATE')
+    else:
+        engine = sa.create_engine(url, echo=False, pool_size=pool_size,
+                                  max_overflow=pool_size, pool_pre_ping=True)
+        write_engine = engine
+
+    __engines = [engine] if write_engine is engine else [engine, write_engine]
     __factory = orm.sessionmaker(bind=engine)
+    __write_factory = orm.sessionmaker(bind=write_engine)
 
     from . import __all_models
 
-    SqlAlchemyBase.metadata.create_all(engine)
+    SqlAlchemyBase.metadata.create_all(write_engine)
+
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for table in SqlAlchemyBase.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(write_engine, checkfirst=True)
+
+    # переносим старую текстовую историю расчетов в таблицу calculations
+    from .calculations import migrate_price_history
+
+    session = __write_factory()
+    try:
+        migrated = migrate_price_history(session)
+        if migrated:
+            print(f"Перенесено записей истории расчетов: {migrated}")
+    finally:
+        session.close()
+
+
+def dispose_engines():
+    """Сброс пулов соединений в дочернем процессе после fork.
+
+    Соединения, открытые в родителе (например, мастером gunicorn с preload),
+    не закрываются, а просто забываются - ими продолжает пользоваться родитель.
+    """
+    for engine in __engines:
+        engine.dispose(close=False)
+
+
+def upsert_insert(db_sess, model):
+    """insert() с поддержкой on_conflict_do_update для диалекта сессии.
+
+    Такой INSERT есть у SQLite и PostgreSQL; для прочих баз возвращает None,
+    и вызывающий делает обычный UPDATE, а при отсутствии строки - INSERT.
+    """
+    dialect = db_sess.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(model)
+
 
 # создаём сессию
 
 
 def create_session() -> Session:
     global __factory
-    return __factory()
\ No newline at end of file
+    return __factory()
+
+
+def create_write_session() -> Session:
+    """Сессия для операций записи (сериализуется через отдельный пул)"""
+    global __write_factory
+    return __write_factory()
@@ -0,0 +1,59 @@
+import datetime
+import sqlalchemy
+from .db_session import SqlAlchemyBase, upsert_insert
+
+
+class Lease(SqlAlchemyBase):
+    """Аренда роли лидера: одна строка на имя, держатель продлевает срок"""
+    __tablename__ = 'leases'
+
+    name = sqlalchemy.Column(sqlalchemy.String(50), primary_key=True)
+    holder = sqlalchemy.Column(sqlalchemy.String(100), nullable=False)
+    expires_at = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<Lease {self.name} {self.holder} до {self.expires_at}>'
+
+
+def acquire_lease(db_sess, name, holder, ttl, now=None):
+    """Захват или продление аренды на ttl секунд.
+
+    Запись проходит, только если аренда свободна, истекла или уже
+    принадлежит holder. Возвращает True, если holder - текущий держатель.
+    """
+    now = now or datetime.datetime.now()
+    expires_at = now + datetime.timedelta(seconds=ttl)
+    takeover = (Lease.holder == holder) | (Lease.expires_at < now)
+    stmt = upsert_insert(db_sess, Lease)
+    if stmt is not None:
+        stmt = stmt.values(name=name, holder=holder, expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'holder': holder, 'expires_at': expires_at},
+            where=takeover
+        )
+        db_sess.execute(stmt)
+        db_sess.commit()
+    else:
+        # без ON CONFLICT: условный UPDATE, а если строки нет - INSERT
+        updated = db_sess.query(Lease).filter(Lease.name == name, takeover).update(
+            {'holder': holder, 'expires_at': expires_at}, synchronize_session=False
+        )
+        if not updated and db_sess.query(Lease.name).filter(Lease.name == name).first() is None:
+            db_sess.add(Lease(name=name, holder=holder, expires_at=expires_at))
+        try:
+            db_sess.commit()
+        except sqlalchemy.exc.IntegrityError:
+            # строку успел вставить другой экземпляр - аренда его
+            db_sess.rollback()
+    return db_sess.query(Lease.holder).filter(Lease.name == name).scalar() == holder
+
+
+def release_lease(db_sess, name, holder):
+    """Досрочное освобождение аренды, чтобы другой экземпляр не ждал истечения"""
+    released = db_sess.query(Lease).filter(
+        Lease.name == name,
+        Lease.holder == holder
+    ).delete(synchronize_session=False)
+    db_sess.commit()
+    return bool(released)
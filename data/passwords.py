@@ -0,0 +1,141 @@
+import collections
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+def normalize_method(method):
+    """Метод werkzeug в каноническом виде, в котором он пишется в хэш.
+
+    pbkdf2:sha256 без числа итераций хранится как pbkdf2:sha256:260000
+    (значение по умолчанию werkzeug). Неподдерживаемый метод - ValueError.
+    """
+    if method.startswith('pbkdf2:'):
+        parts = method.split(':')
+        if len(parts) == 2:
+            parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+        if len(parts) != 3 or not parts[2].isdigit() or int(parts[2]) < 1:
+            raise ValueError(f'Некорректный метод хэширования паролей: {method}')
+        algorithm, iterations = parts[1], int(parts[2])
+        method = f'pbkdf2:{algorithm}:{iterations}'
+    else:
+        algorithm = method
+    if algorithm not in hashlib.algorithms_available:
+        raise ValueError(f'Неподдерживаемый метод хэширования паролей: {method}')
+    return method
+
+
+# Параметры хэширования в формате werkzeug, например pbkdf2:sha256:600000
+PASSWORD_HASH_METHOD = normalize_method(os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+# Сколько задач хэширования может ждать в очереди, прежде чем новые получат отказ
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', PASSWORD_HASH_WORKERS * 4))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+
+__pool = None
+__pool_lock = threading.Lock()
+__slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+
+
+class HashingBusy(Exception):
+    """Очередь хэширования переполнена"""
+
+
+def _get_pool():
+    global __pool
+    if __pool is None:
+        with __pool_lock:
+            if __pool is None:
+                # spawn: не форкаем процесс с потоками waitress и соединениями БД.
+                # Дочерние процессы импортируют главный модуль (как __mp_main__),
+                # поэтому в нем при импорте не должно быть побочных эффектов:
+                # журналы, потоки и сервер запускаются из create_app и
+                # под if __name__ == '__main__'. Сами задачи - функции werkzeug
+                __pool = ProcessPoolExecutor(
+                    max_workers=PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+    return __pool
+
+
+def _reset_after_fork():
+    # пул родителя (если был создан до fork) в дочернем процессе неработоспособен
+    global __pool, __pool_lock, __slots
+    __pool = None
+    __pool_lock = threading.Lock()
+    __slots = threading.BoundedSemaphore(PASSWORD_HASH_QUEUE)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _run(func, *args):
+    """Выполняет тяжелую функцию в пуле процессов, поток запроса только ждет результат"""
+    if not __slots.acquire(timeout=PASSWORD_HASH_TIMEOUT):
+        raise HashingBusy('Слишком много одновременных операций с паролями')
+    try:
+        return _get_pool().submit(func, *args).result(timeout=PASSWORD_HASH_TIMEOUT)
+    finally:
+        __slots.release()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(hashed_password, password):
+    return _run(check_password_hash, hashed_password, password)
+
+
+def needs_rehash(hashed_password):
+    """Хэш создан с другими параметрами, чем текущие"""
+    try:
+        return normalize_method(hashed_password.split('$', 1)[0]) != PASSWORD_HASH_METHOD
+    except ValueError:
+        return True
+
+
+class LoginAttemptLimiter:
+    """Ограничение неудачных попыток входа в скользящем окне по IP и по email"""
+
+    def __init__(self, max_per_ip=20, max_per_email=5, window=300, max_keys=100000):
+        self.limits = {'ip': max_per_ip, 'email': max_per_email}
+        self.window = window
+        self.max_keys = max_keys
+        self._attempts = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        attempts = self._attempts.get(key)
+        if not attempts:
+            return 0
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+            return 0
+        return len(attempts)
+
+    def is_blocked(self, ip, email):
+        now = time.monotonic()
+        with self._lock:
+            return (self._recent(('ip', ip), now) >= self.limits['ip']
+                    or self._recent(('email', email.lower()), now) >= self.limits['email'])
+
+    def register_failure(self, ip, email):
+        now = time.monotonic()
+        with self._lock:
+            for key in (('ip', ip), ('email', email.lower())):
+                self._attempts.setdefault(key, collections.deque()).append(now)
+                self._attempts.move_to_end(key)
+            while len(self._attempts) > self.max_keys:
+                self._attempts.popitem(last=False)
+
+    def reset(self, email):
+        with self._lock:
+            self._attempts.pop(('email', email.lower()), None)
@@ -0,0 +1,169 @@
+import datetime
+import sqlalchemy
+from .db_session import SqlAlchemyBase, upsert_insert
+
+# Размеры агрегационных интервалов
+PERIODS = ('minute', 'hour', 'day')
+
+# Сколько хранить агрегаты каждого интервала (None - бессрочно)
+RETENTION = {
+    'minute': datetime.timedelta(days=2),
+    'hour': datetime.timedelta(days=90),
+    'day': None
+}
+
+# Значение waste_class для строки с итогами по всем классам
+ALL_CLASSES = ''
+
+
+class CalculationRollup(SqlAlchemyBase):
+    __tablename__ = 'calculation_rollups'
+    __table_args__ = (
+        sqlalchemy.UniqueConstraint('period', 'bucket_start', 'waste_class',
+                                    name='uq_calculation_rollups_bucket'),
+    )
+
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
+    period = sqlalchemy.Column(sqlalchemy.String(10), nullable=False)
+    bucket_start = sqlalchemy.Column(sqlalchemy.DateTime, nullable=False)
+    waste_class = sqlalchemy.Column(sqlalchemy.String(10), nullable=False, default=ALL_CLASSES)
+    count = sqlalchemy.Column(sqlalchemy.Integer, nullable=False, default=0)
+    price_sum = sqlalchemy.Column(sqlalchemy.Float, nullable=False, default=0.0)
+    price_sumsq = sqlalchemy.Column(sqlalchemy.Float, nullable=False, default=0.0)
+    volume_sum = sqlalchemy.Column(sqlalchemy.Float, nullable=False, default=0.0)
+
+    @property
+    def avg_price(self):
+        return self.price_sum / self.count if self.count else 0
+
+    @property
+    def avg_volume(self):
+        return self.volume_sum / self.count if self.count else 0
+
+    @property
+    def std_price(self):
+        """Выборочное стандартное отклонение цены по сумме квадратов"""
+        if self.count < 2:
+            return 0
+        variance = (self.price_sumsq - self.price_sum ** 2 / self.count) / (self.count - 1)
+        return max(variance, 0) ** 0.5
+
+    def __repr__(self):
+        return f'<CalculationRollup {self.period} {self.bucket_start} {self.waste_class!r} n={self.count}>'
+
+
+def bucket_start(moment, period):
+    """Начало интервала, в который попадает момент времени"""
+    if period == 'minute':
+        return moment.replace(second=0, microsecond=0)
+    if period == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Неизвестный интервал: {period}")
+
+
+def _upsert_bucket(db_sess, period, start, waste_class, count, price_sum, price_sumsq, volume_sum):
+    increments = {
+        'count': CalculationRollup.count + count,
+        'price_sum': CalculationRollup.price_sum + price_sum,
+        'price_sumsq': CalculationRollup.price_sumsq + price_sumsq,
+        'volume_sum': CalculationRollup.volume_sum + volume_sum
+    }
+    stmt = upsert_insert(db_sess, CalculationRollup)
+    if stmt is None:
+        _update_or_insert_bucket(db_sess, period, start, waste_class, increments,
+                                 count, price_sum, price_sumsq, volume_sum)
+        return
+    stmt = stmt.values(
+        period=period,
+        bucket_start=start,
+        waste_class=waste_class,
+        count=count,
+        price_sum=price_sum,
+        price_sumsq=price_sumsq,
+        volume_sum=volume_sum
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['period', 'bucket_start', 'waste_class'],
+        set_=increments
+    )
+    db_sess.execute(stmt)
+
+
+def _update_or_insert_bucket(db_sess, period, start, waste_class, increments,
+                             count, price_sum, price_sumsq, volume_sum):
+    """Переносимый вариант upsert для баз без ON CONFLICT"""
+    bucket = db_sess.query(CalculationRollup).filter(
+        CalculationRollup.period == period,
+        CalculationRollup.bucket_start == start,
+        CalculationRollup.waste_class == waste_class
+    )
+    if bucket.update(increments, synchronize_session=False):
+        return
+    try:
+        # точка сохранения: при гонке с другим писателем откатывается только вставка
+        with db_sess.begin_nested():
+            db_sess.add(CalculationRollup(
+                period=period,
+                bucket_start=start,
+                waste_class=waste_class,
+                count=count,
+                price_sum=price_sum,
+                price_sumsq=price_sumsq,
+                volume_sum=volume_sum
+            ))
+    except sqlalchemy.exc.IntegrityError:
+        bucket.update(increments, synchronize_session=False)
+
+
+def record_calculation(db_sess, created_at, price, waste_class, volume):
+    """Добавляет расчет во все агрегаты (без commit - в транзакции вызывающего)"""
+    record_calculations(db_sess, created_at, [
+        {'price': price, 'waste_class': waste_class, 'volume': volume}
+    ])
+
+
+def record_calculations(db_sess, created_at, rows):
+    """Добавляет пачку расчетов с общим временем: одна запись на интервал и класс"""
+    totals = {}
+    for row in rows:
+        price = row['price']
+        volume = row['volume'] or 0.0
+        classes = [ALL_CLASSES]
+        if row['waste_class']:
+            classes.append(str(row['waste_class']))
+        for cls in classes:
+            count, price_sum, price_sumsq, volume_sum = totals.get(cls, (0, 0.0, 0.0, 0.0))
+            totals[cls] = (count + 1, price_sum + price, price_sumsq + price * price, volume_sum + volume)
+
+    for period in PERIODS:
+        start = bucket_start(created_at, period)
+        for cls, values in totals.items():
+            _upsert_bucket(db_sess, period, start, cls, *values)
+
+
+def get_buckets(db_sess, period, start, end=None):
+    """Агрегаты интервала period с началом в [start, end)"""
+    query = db_sess.query(CalculationRollup).filter(
+        CalculationRollup.period == period,
+        CalculationRollup.bucket_start >= start
+    )
+    if end is not None:
+        query = query.filter(CalculationRollup.bucket_start < end)
+    return query.order_by(CalculationRollup.bucket_start).all()
+
+
+def prune_rollups(db_sess, now=None):
+    """Удаляет агрегаты старше срока хранения"""
+    now = now or datetime.datetime.now()
+    deleted = 0
+    for period, keep in RETENTION.items():
+        if keep is None:
+            continue
+        deleted += db_sess.query(CalculationRollup).filter(
+            CalculationRollup.period == period,
+            CalculationRollup.bucket_start < now - keep
+        ).delete(synchronize_session=False)
+    db_sess.commit()
+    return deleted
@@ -1,8 +1,11 @@
 import datetime
 import sqlalchemy
+from . import db_session
 from .db_session import SqlAlchemyBase
+from .calculations import Calculation
+from .rollups import record_calculation, record_calculations
 from sqlalchemy import orm
-from werkzeug.security import check_password_hash, generate_password_hash
+from .passwords import hash_password, verify_password, needs_rehash
 from flask_login import UserMixin
 from sqlalchemy_serializer import SerializerMixin
 import secrets
@@ -17,62 +20,85 @@ class User(SqlAlchemyBase, UserMixin, SerializerMixin):
     hashed_password = sqlalchemy.Column(sqlalchemy.String(255), nullable=False)
     login_time = sqlalchemy.Column(sqlalchemy.DateTime, nullable=True)
     logout_time = sqlalchemy.Column(sqlalchemy.DateTime, nullable=True)
+    # Устаревшее поле: история переносится в таблицу calculations при старте
     price_history = sqlalchemy.Column(sqlalchemy.Text, nullable=True, default='')
 
     auth_tokens = orm.relationship("AuthToken", back_populates="user")
     remember_tokens = orm.relationship("RememberToken", back_populates="user")
+    calculations = orm.relationship("Calculation", back_populates="user", lazy='dynamic')
 
     def set_password(self, password):
-        self.hashed_password = generate_password_hash(password)
+        self.hashed_password = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.hashed_password, password)
+        return verify_password(self.hashed_password, password)
 
-    def add_price_to_history(self, price, waste_class, waste_volume, db_sess):
-        """Добавляет цену в историю с классом отходов и объемом"""
-        if self.price_history is None:
-            self.price_history = ''
-
-        timestamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.price_history = f"{timestamp}:{price:.2f}:{waste_class}:{waste_volume}\n{self.price_history}"
+    def password_needs_rehash(self):
+        return needs_rehash(self.hashed_password)
 
-        # Ограничиваем историю 100 последними записями
-        prices = [p for p in self.price_history.split('\n') if p.strip()][:100]
-        self.price_history = '\n'.join(prices)
-
-        db_sess.add(self)
+    def add_price_to_history(self, price, waste_class, waste_volume, db_sess):
+        """Добавляет расчет в историю с классом отходов и объемом"""
+        calculation = Calculation(
+            user_id=self.id,
+            price=round(price, 2),
+            waste_class=waste_class,
+            volume=waste_volume,
+            created_at=datetime.datetime.now()
+        )
+        db_sess.add(calculation)
+        record_calculation(db_sess, calculation.created_at, calculation.price,
+                           calculation.waste_class, calculation.volume)
         db_sess.commit()
-
-    def get_price_history(self):
-        """Возвращает историю цен с классом отходов и объемом"""
-        if not self.price_history:
-            return []
-
-        history = []
-        for entry in self.price_history.split('\n'):
-            if entry.strip():
-                try:
-                    parts = entry.split(':')
-                    timestamp = parts[0]
-                    price = float(parts[1])
-                    waste_class = parts[2] if len(parts) > 2 else None
-                    volume = parts[3] if len(parts) > 3 else None
-
-                    history.append({
-                        'date': timestamp,
-                        'price': price,
-                        'waste_class': waste_class,
-                        'volume': volume
-                    })
-                except (ValueError, IndexError):
-                    continue
-        return history
+        return calculation
+
+    def add_prices_to_history(self, entries, db_sess):
+        """Добавляет пачку расчетов одной транзакцией.
+
+        entries - список словарей с ключами price, waste_class, volume.
+        """
+        created_at = datetime.datetime.now()
+        rows = [
+            {
+                'user_id': self.id,
+                'price': round(entry['price'], 2),
+                'waste_class': entry['waste_class'],
+                'volume': entry['volume'],
+                'created_at': created_at
+            }
+            for entry in entries
+        ]
+        if rows:
+            db_sess.execute(sqlalchemy.insert(Calculation), rows)
+            record_calculations(db_sess, created_at, rows)
+        db_sess.commit()
+        return len(rows)
+
+    def get_price_history(self, limit=100, db_sess=None):
+        """Возвращает последние расчеты пользователя с классом отходов и объемом"""
+        own_session = db_sess is None
+        if own_session:
+            db_sess = db_session.create_session()
+        try:
+            calculations = db_sess.query(Calculation).filter(
+                Calculation.user_id == self.id
+            ).order_by(
+                Calculation.created_at.desc(),
+                Calculation.id.desc()
+            ).limit(limit).all()
+            return [calculation.to_history_entry() for calculation in calculations]
+        finally:
+            if own_session:
+                db_sess.close()
 
     def __repr__(self):
         return f'<User {self.id} {self.email}>'
 
 class AuthToken(SqlAlchemyBase):
     __tablename__ = 'auth_tokens'
+    __table_args__ = (
+        sqlalchemy.Index('ix_auth_tokens_expires_at', 'expires_at'),
+        sqlalchemy.Index('ix_auth_tokens_user_expires', 'user_id', 'expires_at'),
+    )
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     token = sqlalchemy.Column(sqlalchemy.String(100), unique=True, nullable=False)
@@ -85,6 +111,10 @@ class AuthToken(SqlAlchemyBase):
 
 class RememberToken(SqlAlchemyBase):
     __tablename__ = 'remember_tokens'
+    __table_args__ = (
+        sqlalchemy.Index('ix_remember_tokens_expires_at', 'expires_at'),
+        sqlalchemy.Index('ix_remember_tokens_user_expires', 'user_id', 'expires_at'),
+    )
 
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True, autoincrement=True)
     token = sqlalchemy.Column(sqlalchemy.String(100), unique=True, nullable=False)
@@ -95,6 +125,41 @@ class RememberToken(SqlAlchemyBase):
     user = orm.relationship("User", back_populates="remember_tokens")
 
 
+def purge_expired_tokens(db_sess, batch_size=5000, now=None):
+    """Удаляет просроченные токены пачками, фиксируя каждую пачку отдельно"""
+    now = now or datetime.datetime.now()
+    purged = 0
+    for model in (AuthToken, RememberToken):
+        while True:
+            ids = db_sess.query(model.id).filter(
+                model.expires_at <= now
+            ).limit(batch_size).subquery()
+            deleted = db_sess.query(model).filter(
+                model.id.in_(sqlalchemy.select(ids.c.id))
+            ).delete(synchronize_session=False)
+            db_sess.commit()
+            purged += deleted
+            if deleted < batch_size:
+                break
+    return purged
+
+
+def enforce_token_cap(db_sess, model, user_id, max_tokens):
+    """Удаляет самые старые действующие токены пользователя сверх лимита.
+
+    Возвращает строки удаленных токенов (для сброса кэша). Без commit.
+    """
+    stale = db_sess.query(model.id, model.token).filter(
+        model.user_id == user_id,
+        model.expires_at > datetime.datetime.now()
+    ).order_by(model.created_at.desc(), model.id.desc()).offset(max_tokens).all()
+    if stale:
+        db_sess.query(model).filter(
+            model.id.in_([row.id for row in stale])
+        ).delete(synchronize_session=False)
+    return [row.token for row in stale]
+
+
 class ErrorLog(SqlAlchemyBase):
     __tablename__ = 'error_logs'
 
@@ -0,0 +1,39 @@
+# Конфигурация gunicorn: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Несколько процессов (workers) по ядрам и пул потоков (threads) в каждом.
+# SQLite в режиме WAL допускает параллельных читателей из разных процессов,
+# запись сериализуется через BEGIN IMMEDIATE и busy_timeout.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# перезапуск воркеров после N запросов против утечек памяти
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+# приложение (шаблоны, numpy, схема БД) загружается один раз в мастере,
+# воркеры получают его через fork
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+# Периодические задачи выполняет отдельный процесс (python metrics/scheduler.py),
+# а не каждый воркер. Пул соединений воркера - по числу его потоков,
+# процессы хэширования паролей - по одному на воркер.
+os.environ['SCHEDULER_ENABLED'] = 'False'
+os.environ.setdefault('WAITRESS_THREADS', str(threads))
+os.environ.setdefault('PASSWORD_HASH_WORKERS', '1')
+
+
+def post_fork(server, worker):
+    # соединения с БД, открытые мастером при инициализации, воркеру не достаются
+    from data import db_session
+    db_session.dispose_engines()
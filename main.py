@@ -1,17 +1,40 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, make_response
+from flask import (Flask, render_template, redirect, url_for, flash, request, make_response, Response,
+                   send_from_directory)
 import logging
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import LoginManager, logout_user, login_required, login_user, current_user
-from data.users import User, AuthToken, RememberToken
+from data.users import User, AuthToken, RememberToken, purge_expired_tokens, enforce_token_cap
+from data.calculations import Calculation
+from data.rollups import CalculationRollup, ALL_CLASSES, PERIODS
 from data import db_session
+from data.token_cache import TokenCache
+from assets import DIST_DIR, build_assets, load_manifest
+from data.passwords import LoginAttemptLimiter, HashingBusy, hash_password
+from metrics.store import MetricStore
+from metrics.prometheus import Registry, CONTENT_TYPE as PROMETHEUS_CONTENT_TYPE
+from metrics.log_pipeline import BatchingLogHandler
+from metrics.scheduler import init_scheduler as init_metrics_scheduler
+from metrics.instrumentation import instrument_sqlalchemy, begin_request, end_request, dump_profile
 from templates.forms.user import RegisterForm, LoginForm
 from templates.forms.calculator import WasteCalculatorForm
 from waitress import serve
 import os
+import io
+import csv
+import gzip
+import mimetypes
+import json
+import time
+import random
 import datetime
 import secrets
-from apscheduler.schedulers.background import BackgroundScheduler
-from sqlalchemy import func
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+
+try:
+    import brotli
+except ImportError:  # без brotli отдаем только gzip
+    brotli = None
 
 app = Flask(__name__, template_folder="templates")
 login_manager = LoginManager(app)
@@ -24,27 +47,125 @@ app.config.update(
     DEBUG=os.getenv('DEBUG', 'True') == 'True',
     REMEMBER_COOKIE_DURATION=datetime.timedelta(days=30),
     SESSION_PROTECTION="strong",
-    METRICS_LOG_FILE='logs/metrics.log'
+    METRICS_LOG_FILE='logs/metrics.log',
+    TOKEN_CACHE_SIZE=int(os.getenv('TOKEN_CACHE_SIZE', 10000)),
+    TOKEN_CACHE_TTL=int(os.getenv('TOKEN_CACHE_TTL', 60)),
+    BATCH_MAX_LINES=int(os.getenv('BATCH_MAX_LINES', 10000)),
+    EXPORT_CHUNK_SIZE=int(os.getenv('EXPORT_CHUNK_SIZE', 1000)),
+    METRICS_STORE_FILE='logs/minutely_metrics.ndjson',
+    SLOW_LOG_FILE='logs/slow.log',
+    SLOW_REQUEST_MS=float(os.getenv('SLOW_REQUEST_MS', 500)),
+    SLOW_QUERY_MS=float(os.getenv('SLOW_QUERY_MS', 100)),
+    PROFILE_SAMPLE_RATE=float(os.getenv('PROFILE_SAMPLE_RATE', 0)),  # доля запросов под cProfile
+    PROFILE_DIR='logs/profiles',
+    TOKEN_PURGE_INTERVAL=int(os.getenv('TOKEN_PURGE_INTERVAL', 10)),  # минут
+    TOKEN_PURGE_BATCH=int(os.getenv('TOKEN_PURGE_BATCH', 5000)),
+    MAX_TOKENS_PER_USER=int(os.getenv('MAX_TOKENS_PER_USER', 10)),
+    LOG_QUEUE_SIZE=int(os.getenv('LOG_QUEUE_SIZE', 10000)),
+    LOG_MAX_BYTES=int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024)),
+    LOG_OVERFLOW_POLICY=os.getenv('LOG_OVERFLOW_POLICY', 'drop'),  # drop или sample
+    LOGIN_MAX_ATTEMPTS_IP=int(os.getenv('LOGIN_MAX_ATTEMPTS_IP', 20)),
+    LOGIN_MAX_ATTEMPTS_EMAIL=int(os.getenv('LOGIN_MAX_ATTEMPTS_EMAIL', 5)),
+    LOGIN_ATTEMPT_WINDOW=int(os.getenv('LOGIN_ATTEMPT_WINDOW', 300)),  # секунд
+    COMPRESS_MIN_SIZE=500,  # байт, меньше - не сжимаем
+    COMPRESS_GZIP_LEVEL=6,
+    COMPRESS_BROTLI_QUALITY=5,
+    # False для воркеров gunicorn: задачи выполняет отдельный процесс (python metrics/scheduler.py)
+    SCHEDULER_ENABLED=os.getenv('SCHEDULER_ENABLED', 'True') == 'True'
 )
 
-# Настройка логгера метрик
-metrics_logger = logging.getLogger('metrics')
-metrics_logger.setLevel(logging.INFO)
-metrics_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+# Кэш токен -> пользователь для load_user_from_request
+token_cache = TokenCache(
+    max_size=app.config['TOKEN_CACHE_SIZE'],
+    ttl=app.config['TOKEN_CACHE_TTL']
+)
+
+# Собранная статика (python assets.py или flask build-assets), читается в create_app
+asset_manifest = {}
 
-# Создаем папку для логов, если ее нет
-os.makedirs('logs', exist_ok=True)
+# Ограничение неудачных попыток входа
+login_limiter = LoginAttemptLimiter(
+    max_per_ip=app.config['LOGIN_MAX_ATTEMPTS_IP'],
+    max_per_email=app.config['LOGIN_MAX_ATTEMPTS_EMAIL'],
+    window=app.config['LOGIN_ATTEMPT_WINDOW']
+)
+
+metrics_logger = logging.getLogger('metrics')
+slow_logger = logging.getLogger('slow')
+file_handler = None
+slow_handler = None
+
+
+def init_logging():
+    """Файловые журналы метрик и медленных запросов, инструментирование SQLAlchemy.
+
+    Вызывается из create_app, а не при импорте: процессы пула хэширования
+    паролей (spawn) импортируют этот модуль как __mp_main__ и не должны
+    открывать журналы и запускать потоки записи.
+    """
+    global file_handler, slow_handler
+    if file_handler is not None:
+        return
+
+    metrics_logger.setLevel(logging.INFO)
+    metrics_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+    # Создаем папку для логов, если ее нет
+    os.makedirs('logs', exist_ok=True)
+
+    # Обработчик метрик: запись в файл фоновым потоком пачками, с ротацией;
+    # в debug режиме те же пачки дублируются в консоль
+    file_handler = BatchingLogHandler(
+        app.config['METRICS_LOG_FILE'],
+        max_bytes=app.config['LOG_MAX_BYTES'],
+        queue_size=app.config['LOG_QUEUE_SIZE'],
+        policy=app.config['LOG_OVERFLOW_POLICY'],
+        echo=app.config['DEBUG']
+    )
+    file_handler.setFormatter(metrics_formatter)
+    metrics_logger.addHandler(file_handler)
+
+    # Журнал медленных запросов (HTTP и SQL)
+    slow_logger.setLevel(logging.INFO)
+    slow_handler = BatchingLogHandler(
+        app.config['SLOW_LOG_FILE'],
+        max_bytes=app.config['LOG_MAX_BYTES'],
+        queue_size=app.config['LOG_QUEUE_SIZE'],
+        policy=app.config['LOG_OVERFLOW_POLICY']
+    )
+    slow_handler.setFormatter(metrics_formatter)
+    slow_logger.addHandler(slow_handler)
+    instrument_sqlalchemy(app.config['SLOW_QUERY_MS'] / 1000)
+
+
+# Счетчики и гистограммы для выгрузки в формате Prometheus (/metrics)
+prometheus = Registry()
+LOGINS = prometheus.counter('greenatom_logins_total', 'Успешные входы')
+FAILED_LOGINS = prometheus.counter('greenatom_failed_logins_total', 'Неудачные попытки входа')
+RATE_LIMITED_LOGINS = prometheus.counter('greenatom_rate_limited_logins_total', 'Попытки входа, отклоненные лимитом')
+REGISTRATIONS = prometheus.counter('greenatom_registrations_total', 'Регистрации пользователей')
+CALCULATIONS = prometheus.counter('greenatom_calculations_total', 'Расчеты стоимости', ['waste_class'])
+HTTP_ERRORS = prometheus.counter('greenatom_http_errors_total', 'Ответы с ошибкой', ['status'])
+REQUEST_LATENCY = prometheus.histogram(
+    'greenatom_request_duration_seconds', 'Время обработки запроса', ['endpoint', 'method']
+)
+REQUEST_DB_QUERIES = prometheus.histogram(
+    'greenatom_request_db_queries', 'Число SQL-запросов на HTTP-запрос', ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50)
+)
+REQUEST_DB_TIME = prometheus.histogram(
+    'greenatom_request_db_seconds', 'Время SQL-запросов на HTTP-запрос', ['endpoint']
+)
+prometheus.gauge('greenatom_log_records_dropped', 'Записей журнала метрик, отброшенных при переполнении',
+                 lambda: file_handler.dropped if file_handler is not None else 0)
+prometheus.gauge('greenatom_token_cache_entries', 'Записей в кэше токенов', lambda: token_cache.stats()['size'])
+prometheus.counter_func('greenatom_token_cache_hits_total', 'Попадания в кэш токенов',
+                        lambda: token_cache.stats()['hits'])
+prometheus.counter_func('greenatom_token_cache_misses_total', 'Промахи кэша токенов',
+                        lambda: token_cache.stats()['misses'])
 
-# Файловый обработчик для метрик
-file_handler = logging.FileHandler(app.config['METRICS_LOG_FILE'])
-file_handler.setFormatter(metrics_formatter)
-metrics_logger.addHandler(file_handler)
 
-# Консольный обработчик в debug режиме
-if app.config['DEBUG']:
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(metrics_formatter)
-    metrics_logger.addHandler(console_handler)
+scheduler = None
 
 
 def log_metrics():
@@ -57,18 +178,17 @@ def log_metrics():
                 func.date(User.login_time) == datetime.date.today()
             ).distinct(User.id).count()
 
-            # 2. Средняя стоимость чека
-            total_price = 0
-            total_entries = 0
-            users = db_sess.query(User).all()
-            for user in users:
-                history = user.get_price_history()
-                for entry in history:
-                    total_price += entry['price']
-                    total_entries += 1
+            # 2. Средняя стоимость чека (по дневным агрегатам)
+            total_price, total_entries = db_sess.query(
+                func.coalesce(func.sum(CalculationRollup.price_sum), 0),
+                func.coalesce(func.sum(CalculationRollup.count), 0)
+            ).filter(
+                CalculationRollup.period == 'day',
+                CalculationRollup.waste_class == ALL_CLASSES
+            ).one()
             avg_price = round(total_price / total_entries, 2) if total_entries > 0 else 0
 
-            # Логируем метрики
+            # Логируем метрики (кэш токенов свой в каждом процессе - см. /metrics)
             metrics_logger.info(
                 f"METRICS - Unique users today: {unique_users} | "
                 f"Average price: {avg_price}"
@@ -79,17 +199,45 @@ def log_metrics():
             db_sess.close()
 
 
+def scheduled_jobs():
+    """Периодические задачи приложения: (функция, параметры интервала)"""
+    return [
+        (log_metrics, {'hours': 1}),
+        (purge_tokens, {'minutes': app.config['TOKEN_PURGE_INTERVAL']})
+    ]
+
+
 def init_scheduler():
-    """Инициализация планировщика для сбора метрик"""
-    if not app.config['DEBUG']:
-        scheduler = BackgroundScheduler(daemon=True)
-        scheduler.add_job(
-            log_metrics,
-            'interval',
-            hours=1,
-            next_run_time=datetime.datetime.now() + datetime.timedelta(seconds=10)
-        )
-        scheduler.start()
+    """Планировщик в фоне процесса сервера (python main.py).
+
+    Задачи выполняются, только если этот процесс - держатель аренды;
+    параллельно запущенный metrics/scheduler.py их не задублирует.
+    """
+    global scheduler
+    if scheduler is None and not app.config['DEBUG']:
+        scheduler, _ = init_metrics_scheduler(app, jobs=scheduled_jobs())
+
+
+def purge_tokens():
+    """Удаление просроченных auth/remember токенов"""
+    db_sess = db_session.create_write_session()
+    try:
+        purged = purge_expired_tokens(db_sess, batch_size=app.config['TOKEN_PURGE_BATCH'])
+        if purged:
+            metrics_logger.info(f"TOKENS - Purged expired: {purged}")
+    except Exception as e:
+        db_sess.rollback()
+        metrics_logger.error(f"Token purge error: {str(e)}")
+    finally:
+        db_sess.close()
+
+
+def cap_user_tokens(db_sess, user_id):
+    """Ограничение числа действующих токенов пользователя (без commit)"""
+    limit = app.config['MAX_TOKENS_PER_USER']
+    for model, prefix in ((AuthToken, 'auth'), (RememberToken, 'remember')):
+        for token in enforce_token_cap(db_sess, model, user_id, limit):
+            token_cache.invalidate(f'{prefix}:{token}')
 
 
 def initialize_database():
@@ -97,6 +245,24 @@ def initialize_database():
     db_session.global_init("db/GreenAtom.db")
 
 
+def create_app(start_scheduler=None):
+    """Фабрика приложения: журналы, БД и, при необходимости, планировщик.
+
+    Повторный вызов безопасен. Под gunicorn с preload_app вызывается один раз
+    в мастере (wsgi.py), а воркеры после fork только сбрасывают пулы
+    соединений (post_fork в gunicorn.conf.py); планировщик в воркерах
+    не запускается, чтобы задачи не выполнялись по разу на каждый процесс.
+    """
+    init_logging()
+    asset_manifest.update(load_manifest(app.static_folder))
+    initialize_database()
+    if start_scheduler is None:
+        start_scheduler = app.config['SCHEDULER_ENABLED']
+    if start_scheduler:
+        init_scheduler()
+    return app
+
+
 @login_manager.user_loader
 def load_user(user_id):
     """Загрузка пользователя для Flask-Login"""
@@ -107,6 +273,15 @@ def load_user(user_id):
         db_sess.close()
 
 
+def find_user_by_email(email):
+    """Поиск пользователя по email через читающую сессию"""
+    db_sess = db_session.create_session()
+    try:
+        return db_sess.query(User).filter(User.email == email).first()
+    finally:
+        db_sess.close()
+
+
 @app.route('/')
 @app.route('/index')
 def index():
@@ -122,28 +297,34 @@ def register():
 
     form = RegisterForm()
     if form.validate_on_submit():
-        db_sess = db_session.create_session()
+        db_sess = db_session.create_write_session()
         try:
             if form.password.data != form.password_again.data:
                 flash('Пароли не совпадают', 'error')
                 return render_template('register.html', form=form)
 
-            if db_sess.query(User).filter(User.email == form.email.data).first():
+            if find_user_by_email(form.email.data):
                 flash('Пользователь с таким email уже существует', 'error')
                 return render_template('register.html', form=form)
 
+            # Хэшируем до начала пишущей транзакции
             user = User(
                 email=form.email.data,
                 name=form.name.data,
-                hashed_password=generate_password_hash(form.password.data)
+                hashed_password=hash_password(form.password.data)
             )
 
             db_sess.add(user)
             db_sess.commit()
 
             metrics_logger.info(f"REGISTER - New user: {user.email}")
+            REGISTRATIONS.inc()
             flash('Регистрация прошла успешно! Теперь вы можете войти.', 'success')
             return redirect(url_for('login'))
+        except HashingBusy:
+            metrics_logger.warning("Registration rejected: password hashing queue is full")
+            flash('Сервер перегружен, повторите попытку', 'error')
+            return render_template('register.html', form=form, user=current_user), 503
         except Exception as e:
             db_sess.rollback()
             metrics_logger.error(f"Registration error: {str(e)}")
@@ -160,13 +341,20 @@ def load_user_from_request(request):
     # Проверка обычного auth токена
     auth_token = request.cookies.get('auth_token')
     if auth_token:
+        user = token_cache.get(f'auth:{auth_token}')
+        if user:
+            return user
+
         db_sess = db_session.create_session()
         try:
-            token = db_sess.query(AuthToken).filter(
+            token = db_sess.query(AuthToken).options(
+                joinedload(AuthToken.user)
+            ).filter(
                 AuthToken.token == auth_token,
                 AuthToken.expires_at > datetime.datetime.now()
             ).first()
-            if token:
+            if token and token.user:
+                token_cache.set(f'auth:{auth_token}', token.user, token.expires_at)
                 return token.user
         finally:
             db_sess.close()
@@ -174,13 +362,24 @@ def load_user_from_request(request):
     # Проверка remember me токена
     remember_token = request.cookies.get('remember_token')
     if remember_token:
+        user = token_cache.get(f'remember:{remember_token}')
+        if user:
+            return user
+
         db_sess = db_session.create_session()
         try:
-            token = db_sess.query(RememberToken).filter(
+            token = db_sess.query(RememberToken).options(
+                joinedload(RememberToken.user)
+            ).filter(
                 RememberToken.token == remember_token,
                 RememberToken.expires_at > datetime.datetime.now()
             ).first()
-            if token:
+        finally:
+            db_sess.close()
+
+        if token and token.user:
+            db_sess = db_session.create_write_session()
+            try:
                 # Создаем новую сессию
                 auth_token = AuthToken(
                     user_id=token.user_id,
@@ -188,6 +387,8 @@ def load_user_from_request(request):
                     expires_at=datetime.datetime.now() + datetime.timedelta(days=1)
                 )
                 db_sess.add(auth_token)
+                db_sess.flush()
+                cap_user_tokens(db_sess, token.user_id)
                 db_sess.commit()
 
                 response = make_response()
@@ -199,9 +400,10 @@ def load_user_from_request(request):
                     secure=not app.debug,
                     samesite='Lax'
                 )
+                token_cache.set(f'remember:{remember_token}', token.user, token.expires_at)
                 return token.user
-        finally:
-            db_sess.close()
+            finally:
+                db_sess.close()
 
     return None
 
@@ -214,12 +416,26 @@ def login():
 
     form = LoginForm()
     if form.validate_on_submit():
-        db_sess = db_session.create_session()
+        # Перебор паролей отсекаем до хэширования
+        if login_limiter.is_blocked(request.remote_addr, form.email.data):
+            metrics_logger.warning(f"Login rate limited for email: {form.email.data}")
+            RATE_LIMITED_LOGINS.inc()
+            flash('Слишком много попыток входа. Попробуйте позже', 'error')
+            return render_template('login.html', form=form), 429
+
+        db_sess = db_session.create_write_session()
         try:
-            user = db_sess.query(User).filter(User.email == form.email.data).first()
+            # Поиск и проверка пароля выполняются вне пишущей транзакции
+            user = find_user_by_email(form.email.data)
 
             if user and user.check_password(form.password.data):
+                login_limiter.reset(form.email.data)
                 user.login_time = datetime.datetime.now()
+                values = {User.login_time: user.login_time}
+                # Параметры хэширования изменились - пересчитываем хэш, пока пароль известен
+                if user.password_needs_rehash():
+                    values[User.hashed_password] = hash_password(form.password.data)
+                db_sess.query(User).filter(User.id == user.id).update(values)
 
                 # Создаем обычный auth токен
                 auth_token = AuthToken(
@@ -256,14 +472,23 @@ def login():
                         samesite='Lax'
                     )
 
+                db_sess.flush()
+                cap_user_tokens(db_sess, user.id)
                 db_sess.commit()
                 login_user(user, remember=form.remember_me.data)
 
                 metrics_logger.info(f"LOGIN - User: {user.email}")
+                LOGINS.inc()
                 return resp
 
+            login_limiter.register_failure(request.remote_addr, form.email.data)
             metrics_logger.warning(f"Failed login attempt for email: {form.email.data}")
+            FAILED_LOGINS.inc()
             flash('Неверный email или пароль', 'error')
+        except HashingBusy:
+            metrics_logger.warning("Login rejected: password hashing queue is full")
+            flash('Сервер перегружен, повторите попытку', 'error')
+            return render_template('login.html', form=form), 503
         except Exception as e:
             db_sess.rollback()
             metrics_logger.error(f"Login error: {str(e)}")
@@ -294,15 +519,23 @@ def waste_calculator():
         waste_class = request.form.get('waste_class')
         waste_volume = float(request.form.get('waste_volume'))
 
+        # класс идет в метки Prometheus и агрегаты, поэтому только из RATES
+        if waste_class not in RATES:
+            flash('Неизвестный класс отходов', 'error')
+            return render_template('waste_calculator.html',
+                                   form=form,
+                                   price_history=current_user.get_price_history()), 400
+
         # Расчет стоимости
-        rate = RATES.get(waste_class, 0)
+        rate = RATES[waste_class]
         result = rate * waste_volume
 
         # Сохранение в историю пользователя
-        db_sess = db_session.create_session()
+        db_sess = db_session.create_write_session()
         try:
             user = db_sess.query(User).get(current_user.id)
             user.add_price_to_history(result, waste_class, waste_volume, db_sess)
+            CALCULATIONS.inc(waste_class=waste_class)
 
             metrics_logger.info(
                 f"CALCULATION - User: {user.email} | "
@@ -330,11 +563,213 @@ def waste_calculator():
                            price_history=price_history)
 
 
+def parse_batch_lines():
+    """Строки пакетного расчета из тела запроса: JSON-массив или CSV"""
+    if request.mimetype in ('text/csv', 'application/csv'):
+        reader = csv.DictReader(io.StringIO(request.get_data(as_text=True)))
+        return [{'waste_class': row.get('waste_class'), 'volume': row.get('volume')} for row in reader]
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('items')
+    if not isinstance(data, list):
+        raise ValueError('Ожидается JSON-массив строк или CSV с колонками waste_class,volume')
+    return [item if isinstance(item, dict) else {} for item in data]
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def price_batch(lines):
+    """Векторный расчет стоимости: возвращает (классы, объемы, цены, маска корректных строк)"""
+    classes = np.array([str(line.get('waste_class') or '').strip() for line in lines], dtype=object)
+    volumes = np.array([_to_float(line.get('volume')) for line in lines], dtype=np.float64)
+
+    rates = np.zeros(len(lines), dtype=np.float64)
+    for waste_class, rate in RATES.items():
+        rates[classes == waste_class] = rate
+
+    valid = (rates > 0) & np.isfinite(volumes) & (volumes > 0)
+    prices = np.round(rates * np.where(valid, volumes, 0), 2)
+    return classes, volumes, prices, valid
+
+
+@app.route('/api/calculations/batch', methods=['POST'])
+@login_required
+def calculations_batch():
+    """Пакетный расчет стоимости: JSON или CSV на входе, NDJSON построчно на выходе"""
+    try:
+        lines = parse_batch_lines()
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    if len(lines) > app.config['BATCH_MAX_LINES']:
+        return {'error': f"Не более {app.config['BATCH_MAX_LINES']} строк за запрос"}, 413
+
+    classes, volumes, prices, valid = price_batch(lines)
+    entries = [
+        {'price': float(prices[i]), 'waste_class': classes[i], 'volume': float(volumes[i])}
+        for i in np.flatnonzero(valid)
+    ]
+
+    db_sess = db_session.create_write_session()
+    try:
+        user = db_sess.query(User).get(current_user.id)
+        saved = user.add_prices_to_history(entries, db_sess)
+        for entry in entries:
+            CALCULATIONS.inc(waste_class=entry['waste_class'])
+        metrics_logger.info(
+            f"BATCH CALCULATION - User: {user.email} | "
+            f"Lines: {len(lines)} | "
+            f"Saved: {saved} | "
+            f"Total: {sum(entry['price'] for entry in entries):.2f}"
+        )
+    except Exception as e:
+        db_sess.rollback()
+        metrics_logger.error(f"Batch calculation error: {str(e)}")
+        return {'error': 'Ошибка при сохранении расчетов'}, 500
+    finally:
+        db_sess.close()
+
+    def generate():
+        for i in range(len(lines)):
+            if valid[i]:
+                row = {'line': i, 'waste_class': classes[i], 'volume': float(volumes[i]), 'price': float(prices[i])}
+            else:
+                row = {'line': i, 'error': 'Некорректный класс отходов или объем'}
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson'
+}
+
+
+def _parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+def stream_export(query, columns, fmt, filename):
+    """Потоковая выгрузка результата запроса: строки читаются курсором пачками"""
+    def generate():
+        db_sess = db_session.create_session()
+        try:
+            result = db_sess.execute(query.execution_options(yield_per=app.config['EXPORT_CHUNK_SIZE']))
+            if fmt == 'csv':
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                for chunk in result.partitions():
+                    for row in chunk:
+                        writer.writerow(row)
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                yield buffer.getvalue()
+            else:
+                for chunk in result.partitions():
+                    yield ''.join(
+                        json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + '\n'
+                        for row in chunk
+                    )
+        finally:
+            db_sess.close()
+
+    resp = Response(generate(), mimetype=EXPORT_FORMATS[fmt])
+    resp.headers['Content-Disposition'] = f'attachment; filename={filename}.{fmt}'
+    return resp
+
+
+@app.route('/api/calculations/export')
+@login_required
+def export_calculations():
+    """Выгрузка истории расчетов пользователя в CSV/NDJSON"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return {'error': f"Формат должен быть одним из: {', '.join(EXPORT_FORMATS)}"}, 400
+    try:
+        date_from = _parse_date_arg('date_from')
+        date_to = _parse_date_arg('date_to')
+    except ValueError:
+        return {'error': 'Даты ожидаются в формате ISO (YYYY-MM-DD[THH:MM:SS])'}, 400
+
+    query = select(
+        Calculation.created_at, Calculation.waste_class, Calculation.volume, Calculation.price
+    ).where(Calculation.user_id == current_user.id)
+    if date_from:
+        query = query.where(Calculation.created_at >= date_from)
+    if date_to:
+        query = query.where(Calculation.created_at < date_to)
+    if request.args.get('waste_class'):
+        query = query.where(Calculation.waste_class == request.args['waste_class'])
+    query = query.order_by(Calculation.created_at, Calculation.id)
+
+    return stream_export(query, ['created_at', 'waste_class', 'volume', 'price'], fmt, 'calculations')
+
+
+@app.route('/api/metrics/export')
+@login_required
+def export_metrics():
+    """Выгрузка агрегатов расчетов (minute/hour/day) в CSV/NDJSON"""
+    fmt = request.args.get('format', 'csv')
+    period = request.args.get('period', 'hour')
+    if fmt not in EXPORT_FORMATS:
+        return {'error': f"Формат должен быть одним из: {', '.join(EXPORT_FORMATS)}"}, 400
+    if period not in PERIODS:
+        return {'error': f"Период должен быть одним из: {', '.join(PERIODS)}"}, 400
+    try:
+        date_from = _parse_date_arg('date_from')
+        date_to = _parse_date_arg('date_to')
+    except ValueError:
+        return {'error': 'Даты ожидаются в формате ISO (YYYY-MM-DD[THH:MM:SS])'}, 400
+
+    query = select(
+        CalculationRollup.bucket_start, CalculationRollup.waste_class, CalculationRollup.count,
+        CalculationRollup.price_sum, CalculationRollup.price_sumsq, CalculationRollup.volume_sum
+    ).where(CalculationRollup.period == period)
+    if date_from:
+        query = query.where(CalculationRollup.bucket_start >= date_from)
+    if date_to:
+        query = query.where(CalculationRollup.bucket_start < date_to)
+    if 'waste_class' in request.args:
+        query = query.where(CalculationRollup.waste_class == request.args['waste_class'])
+    query = query.order_by(CalculationRollup.bucket_start, CalculationRollup.waste_class)
+
+    return stream_export(
+        query,
+        ['bucket_start', 'waste_class', 'count', 'price_sum', 'price_sumsq', 'volume_sum'],
+        fmt, f'metrics_{period}'
+    )
+
+
+@app.route('/api/metrics/minutely')
+@login_required
+def minutely_metrics():
+    """Прореженный ряд минутных метрик за последний час или сутки"""
+    store = MetricStore(app.config['METRICS_STORE_FILE'])
+    window = request.args.get('range', 'hour')
+    if window == 'hour':
+        return {'range': window, 'series': store.last_hour()}
+    if window == 'day':
+        return {'range': window, 'series': store.last_day()}
+    return {'error': 'range должен быть hour или day'}, 400
+
+
 @app.route('/logout')
 @login_required
 def logout():
     """Выход из системы"""
-    db_sess = db_session.create_session()
+    db_sess = db_session.create_write_session()
     try:
         user = db_sess.query(User).get(current_user.id)
         if user:
@@ -350,6 +785,7 @@ def logout():
                 ).first()
                 if token:
                     db_sess.delete(token)
+                token_cache.invalidate(f'auth:{auth_token}')
 
             # Удаляем remember токен
             remember_token = request.cookies.get('remember_token')
@@ -360,6 +796,7 @@ def logout():
                 ).first()
                 if token:
                     db_sess.delete(token)
+                token_cache.invalidate(f'remember:{remember_token}')
 
             db_sess.commit()
             metrics_logger.info(f"LOGOUT - User: {user.email}")
@@ -378,10 +815,147 @@ def logout():
         db_sess.close()
 
 
+@app.before_request
+def start_request_timer():
+    profile = random.random() < app.config['PROFILE_SAMPLE_RATE']
+    begin_request(profile=profile)
+
+
+@app.after_request
+def observe_request_latency(response):
+    stats = end_request()
+    if stats is None:
+        return response
+
+    elapsed = stats.elapsed
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_LATENCY.observe(elapsed, endpoint=endpoint, method=request.method)
+    REQUEST_DB_QUERIES.observe(stats.queries, endpoint=endpoint)
+    REQUEST_DB_TIME.observe(stats.db_time, endpoint=endpoint)
+
+    if elapsed * 1000 >= app.config['SLOW_REQUEST_MS']:
+        slow_logger.warning(
+            f"SLOW REQUEST {request.method} {request.path} ({endpoint}) | "
+            f"{elapsed * 1000:.1f} ms | "
+            f"DB: {stats.queries} queries, {stats.db_time * 1000:.1f} ms | "
+            f"Status: {response.status_code}"
+        )
+    if stats.profiler is not None:
+        try:
+            dump_profile(stats, app.config['PROFILE_DIR'], endpoint)
+        except Exception as e:
+            metrics_logger.error(f"Profile dump error: {str(e)}")
+    return response
+
+
+# Типы ответов, которые сжимаются на лету
+COMPRESSIBLE_MIMETYPES = {
+    'text/html', 'text/plain', 'text/css', 'text/csv',
+    'application/json', 'application/javascript', 'image/svg+xml'
+}
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+
+def _accepted_encoding():
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if request.accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+@app.after_request
+def compress_response(response):
+    """ETag/304 и gzip/brotli для динамических ответов"""
+    if (request.method not in ('GET', 'HEAD') or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    encoding = _accepted_encoding() if (response.content_length or 0) >= app.config['COMPRESS_MIN_SIZE'] else None
+    response.vary.add('Accept-Encoding')
+    if response.mimetype == 'text/html' and 'Cache-Control' not in response.headers:
+        # страницы персональные: кэшировать только в браузере и всегда перепроверять
+        response.headers['Cache-Control'] = 'private, no-cache'
+
+    # ETag по несжатому телу, с суффиксом кодировки, чтобы варианты не смешивались
+    response.add_etag()
+    etag, _ = response.get_etag()
+    if encoding:
+        response.set_etag(f'{etag}-{encoding}')
+    response.make_conditional(request)
+    if response.status_code == 304 or not encoding:
+        return response
+
+    data = response.get_data()
+    if encoding == 'br':
+        data = brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    else:
+        data = gzip.compress(data, compresslevel=app.config['COMPRESS_GZIP_LEVEL'])
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@app.url_defaults
+def fingerprint_static_url(endpoint, values):
+    """url_for('static', ...) указывает на собранную копию с хэшем в имени"""
+    if endpoint == 'static' and values.get('filename') in asset_manifest:
+        values['filename'] = asset_manifest[values['filename']]
+
+
+def send_static(filename):
+    """Раздача статики: собранные файлы - с предсжатыми копиями и бессрочным кэшем"""
+    if not filename.startswith(f'{DIST_DIR}/'):
+        return app.send_static_file(filename)
+
+    encoding = _accepted_encoding()
+    suffix = {'br': '.br', 'gzip': '.gz'}.get(encoding)
+    if suffix and os.path.isfile(os.path.join(app.static_folder, filename + suffix)):
+        response = send_from_directory(
+            app.static_folder, filename + suffix,
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        )
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_from_directory(app.static_folder, filename)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE
+    return response
+
+
+app.view_functions['static'] = send_static
+
+
+@app.route('/favicon.ico')
+def favicon():
+    response = send_from_directory(app.static_folder, 'favicon.ico',
+                                   mimetype='image/vnd.microsoft.icon',
+                                   max_age=7 * 24 * 60 * 60)
+    response.cache_control.public = True
+    return response
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Сборка статики с отпечатками и предсжатыми копиями"""
+    built = build_assets(app.static_folder)
+    print(f"Собрано файлов статики: {len(built)}")
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Метрики приложения в текстовом формате Prometheus"""
+    return Response(prometheus.exposition(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     """Обработка 404 ошибки"""
     metrics_logger.error(f"404 Not Found: {request.url}")
+    HTTP_ERRORS.inc(status='404')
     return render_template('404.html'), 404
 
 
@@ -389,6 +963,7 @@ def page_not_found(e):
 def internal_server_error(e):
     """Обработка 500 ошибки"""
     metrics_logger.error(f"500 Internal Server Error: {str(e)}")
+    HTTP_ERRORS.inc(status='500')
     return render_template('500.html'), 500
 
 
@@ -396,16 +971,13 @@ def run_server():
     """Запуск сервера"""
     port = int(os.getenv("PORT", 5000))
 
-    # Инициализация планировщика метрик
-    init_scheduler()
-
     if app.config['DEBUG']:
         app.logger.setLevel(logging.DEBUG)
         app.run(host='0.0.0.0', port=port, debug=True)
     else:
-        serve(app, host='0.0.0.0', port=port)
+        serve(app, host='0.0.0.0', port=port, threads=int(os.getenv('WAITRESS_THREADS', 4)))
 
 
 if __name__ == '__main__':
-    initialize_database()
+    create_app()
     run_server()
\ No newline at end of file
@@ -1,107 +1,86 @@
 # collector.py
 from datetime import datetime, timedelta
-from collections import defaultdict
-import statistics
+from sqlalchemy import or_
+
+from data.rollups import ALL_CLASSES, bucket_start, get_buckets
 
 
 class MetricsCollector:
     @staticmethod
     def collect_all(db_sess):
-        from .models import User, ErrorLog
+        from data.users import User, ErrorLog
 
         now = datetime.now()
-        minute_key = now.strftime('%Y-%m-%d %H:%M')
-        hour_key = now.strftime('%Y-%m-%d %H:00')
-        day_key = now.strftime('%Y-%m-%d')
+        # Последняя завершившаяся минута
+        minute_start = bucket_start(now, 'minute') - timedelta(minutes=1)
+        hour_start = bucket_start(now, 'hour')
+        day_start = bucket_start(now, 'day')
+
+        minute_key = minute_start.strftime('%Y-%m-%d %H:%M')
+        hour_key = hour_start.strftime('%Y-%m-%d %H:00')
 
-        users = db_sess.query(User).all()
         recent_errors = db_sess.query(ErrorLog).filter(
             ErrorLog.timestamp >= now - timedelta(minutes=1)
         ).count()
+        errors_today = db_sess.query(ErrorLog).filter(
+            ErrorLog.timestamp >= day_start
+        ).count()
 
-        metrics = {
-            'minutely': defaultdict(list),
-            'hourly': defaultdict(list),
-            'daily': defaultdict(list),
-            'user_activity': {
-                'logins_last_min': 0,
-                'active_sessions': 0,
-                'new_sessions': 0
-            },
-            'errors': {
-                'last_minute': recent_errors,
-                'total_today': db_sess.query(ErrorLog).filter(
-                    ErrorLog.timestamp >= datetime(now.year, now.month, now.day)
-                ).count()
-            }
-        }
-
-        for user in users:
-            # Анализ активности
-            if user.login_time and (now - user.login_time <= timedelta(minutes=1)):
-                metrics['user_activity']['logins_last_min'] += 1
-
-            if user.login_time and ((not user.logout_time) or (user.login_time > user.logout_time)):
-                metrics['user_activity']['active_sessions'] += 1
-
-            # Анализ транзакций
-            price_history = user.get_price_history()
-            for entry in price_history:
-                entry_time = datetime.strptime(entry['date'], '%Y-%m-%d %H:%M:%S')
-                time_diff = now - entry_time
-
-                if time_diff <= timedelta(minutes=1):
-                    metrics['minutely']['prices'].append(entry['price'])
-                    if entry['volume']:
-                        metrics['minutely']['volumes'].append(float(entry['volume']))
-                    if entry['waste_class']:
-                        metrics['minutely'][f"waste_{entry['waste_class']}"].append(entry['price'])
+        # Активность пользователей считаем в БД, не загружая записи
+        logins_last_min = db_sess.query(User).filter(
+            User.login_time >= now - timedelta(minutes=1)
+        ).count()
+        active_sessions = db_sess.query(User).filter(
+            User.login_time.isnot(None),
+            or_(User.logout_time.is_(None), User.login_time > User.logout_time)
+        ).count()
 
-                if time_diff <= timedelta(hours=1):
-                    metrics['hourly'][hour_key].append(entry['price'])
+        # Транзакции читаем из заранее посчитанных агрегатов
+        minute_buckets = get_buckets(db_sess, 'minute', minute_start, minute_start + timedelta(minutes=1))
+        hour_buckets = get_buckets(db_sess, 'hour', hour_start)
+        day_buckets = get_buckets(db_sess, 'day', day_start)
 
-                if entry_time.date() == now.date():
-                    metrics['daily'][day_key].append(entry['price'])
+        minute_total = next((b for b in minute_buckets if b.waste_class == ALL_CLASSES), None)
+        hour_total = next((b for b in hour_buckets if b.waste_class == ALL_CLASSES), None)
+        day_total = next((b for b in day_buckets if b.waste_class == ALL_CLASSES), None)
 
-        # Расчет агрегированных метрик
         result = {
             'timestamp': now.isoformat(),
             'metrics': {
                 'current_minute': minute_key,
-                'transactions_last_min': len(metrics['minutely']['prices']),
-                'avg_price_last_min': statistics.mean(metrics['minutely']['prices']) if metrics['minutely'][
-                    'prices'] else 0,
-                'avg_volume_last_min': statistics.mean(metrics['minutely']['volumes']) if metrics['minutely'][
-                    'volumes'] else 0,
-                'active_sessions': metrics['user_activity']['active_sessions'],
-                'new_logins': metrics['user_activity']['logins_last_min'],
-                'errors_last_min': metrics['errors']['last_minute'],
+                'transactions_last_min': minute_total.count if minute_total else 0,
+                'avg_price_last_min': minute_total.avg_price if minute_total else 0,
+                'std_price_last_min': minute_total.std_price if minute_total else 0,
+                'avg_volume_last_min': minute_total.avg_volume if minute_total else 0,
+                'active_sessions': active_sessions,
+                'new_logins': logins_last_min,
+                'errors_last_min': recent_errors,
+                'errors_today': errors_today,
                 'hourly_metrics': {},
                 'waste_class_metrics': {}
             }
         }
 
-        # Добавляем метрики по классам отходов
-        for key in metrics['minutely']:
-            if key.startswith('waste_'):
-                class_name = key.replace('waste_', '')
-                result['metrics']['waste_class_metrics'][class_name] = {
-                    'avg_price': statistics.mean(metrics['minutely'][key]),
-                    'transactions': len(metrics['minutely'][key])
+        # Метрики по классам отходов
+        for bucket in minute_buckets:
+            if bucket.waste_class != ALL_CLASSES:
+                result['metrics']['waste_class_metrics'][bucket.waste_class] = {
+                    'avg_price': bucket.avg_price,
+                    'transactions': bucket.count
                 }
 
-        # Агрегация по часам
-        for hour, prices in metrics['hourly'].items():
-            result['metrics']['hourly_metrics'][hour] = {
-                'avg_price': statistics.mean(prices) if prices else 0,
-                'transactions': len(prices)
+        # Текущий час
+        if hour_total:
+            result['metrics']['hourly_metrics'][hour_key] = {
+                'avg_price': hour_total.avg_price,
+                'transactions': hour_total.count
             }
 
         # Дневные метрики
-        for day, prices in metrics['daily'].items():
+        if day_total:
             result['metrics']['daily_metrics'] = {
-                'avg_price': statistics.mean(prices) if prices else 0,
-                'transactions': len(prices)
+                'avg_price': day_total.avg_price,
+                'transactions': day_total.count
             }
 
-        return result
\ No newline at end of file
+        return result
@@ -1,5 +1,7 @@
 from .collector import MetricsCollector
 from .logger import MetricLogger
+from .store import MetricStore
+from .prometheus import Registry
 from .scheduler import init_scheduler
 
-__all__ = ['MetricsCollector', 'MetricLogger', 'init_scheduler']
\ No newline at end of file
+__all__ = ['MetricsCollector', 'MetricLogger', 'MetricStore', 'Registry', 'init_scheduler']
\ No newline at end of file
@@ -0,0 +1,83 @@
+# instrumentation.py
+import cProfile
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+slow_logger = logging.getLogger('slow')
+
+_local = threading.local()
+
+
+class RequestStats:
+    """Статистика обращений к БД в рамках одного запроса (одного потока)"""
+
+    __slots__ = ('started', 'queries', 'db_time', 'profiler')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.profiler = None
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def begin_request(profile=False):
+    stats = RequestStats()
+    if profile:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            stats.profiler = profiler
+        except ValueError:
+            # другой профилировщик уже активен в процессе
+            pass
+    _local.stats = stats
+    return stats
+
+
+def end_request():
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    if stats is not None and stats.profiler is not None:
+        stats.profiler.disable()
+    return stats
+
+
+def dump_profile(stats, directory, name):
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f"{name}-{datetime.now():%Y%m%d-%H%M%S-%f}.prof")
+    stats.profiler.dump_stats(filename)
+    return filename
+
+
+def instrument_sqlalchemy(slow_query_threshold):
+    """Подсчет запросов и времени БД для всех движков + журнал медленных запросов"""
+
+    # время старта хранится в контексте выполнения: он свой у каждого запроса и
+    # уходит вместе с ним, в том числе если запрос завершился ошибкой
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start = time.perf_counter()
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_query_start', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        stats = getattr(_local, 'stats', None)
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+        if elapsed >= slow_query_threshold:
+            slow_logger.warning(f"SLOW QUERY {elapsed * 1000:.1f} ms: {' '.join(statement.split())[:500]}")
@@ -0,0 +1,79 @@
+# leader.py
+import functools
+import logging
+import os
+import socket
+import time
+import uuid
+
+from data import db_session
+from data.leases import acquire_lease, release_lease
+
+logger = logging.getLogger('metrics')
+
+
+class LeaderLease:
+    """Выбор единственного исполнителя периодических задач.
+
+    Аренда хранится в общей SQLite базе, поэтому работает между процессами
+    и контейнерами, смонтировавшими один файл БД. Держатель продлевает
+    аренду каждые ttl/3 секунд; локально считает себя лидером только 2/3 ttl
+    после последнего продления, то есть перестает выполнять задачи раньше,
+    чем аренду сможет забрать другой экземпляр.
+    """
+
+    def __init__(self, name, ttl=60, holder=None):
+        self.name = name
+        self.ttl = ttl
+        self.holder = holder or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.renew_interval = ttl / 3
+        self._valid_until = 0.0
+
+    @property
+    def is_leader(self):
+        return time.monotonic() < self._valid_until
+
+    def renew(self):
+        """Захват или продление аренды; возвращает текущий статус лидера"""
+        was_leader = self.is_leader
+        started = time.monotonic()
+        db_sess = db_session.create_write_session()
+        try:
+            acquired = acquire_lease(db_sess, self.name, self.holder, self.ttl)
+        except Exception as e:
+            db_sess.rollback()
+            logger.error(f"Lease {self.name} renew error: {str(e)}")
+            acquired = False
+        finally:
+            db_sess.close()
+
+        if acquired:
+            self._valid_until = started + self.ttl * 2 / 3
+            if not was_leader:
+                logger.info(f"LEADER - {self.holder} acquired lease {self.name}")
+        elif was_leader and not self.is_leader:
+            logger.warning(f"LEADER - {self.holder} lost lease {self.name}")
+        return self.is_leader
+
+    def release(self):
+        if not self.is_leader:
+            return
+        self._valid_until = 0.0
+        db_sess = db_session.create_write_session()
+        try:
+            release_lease(db_sess, self.name, self.holder)
+        except Exception as e:
+            db_sess.rollback()
+            logger.error(f"Lease {self.name} release error: {str(e)}")
+        finally:
+            db_sess.close()
+
+    def leader_only(self, func):
+        """Обертка задачи: на экземплярах без аренды задача пропускается"""
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if self.is_leader:
+                return func(*args, **kwargs)
+
+        return wrapper
@@ -0,0 +1,160 @@
+# log_pipeline.py
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+
+class _RotatingFile:
+    """Файл журнала с ротацией по размеру; пишется целыми пачками"""
+
+    def __init__(self, path, max_bytes, backup_count):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.stream = open(path, 'a', encoding='utf-8')
+
+    def write(self, text):
+        self.stream.write(text)
+        self.stream.flush()
+        if self.max_bytes and self.stream.tell() >= self.max_bytes:
+            if self._rotated_elsewhere():
+                self.reopen()
+            else:
+                self._rotate()
+
+    def _rotated_elsewhere(self):
+        # файл уже переименован другим процессом, пишущим в тот же журнал
+        try:
+            return os.stat(self.path).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def reopen(self):
+        self.stream.close()
+        self.stream = open(self.path, 'a', encoding='utf-8')
+
+    def _rotate(self):
+        self.stream.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f'{self.path}.{i}'
+            if os.path.exists(src):
+                os.replace(src, f'{self.path}.{i + 1}')
+        if self.backup_count > 0:
+            os.replace(self.path, f'{self.path}.1')
+        self.stream = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        self.stream.close()
+
+
+class BatchingLogHandler(logging.Handler):
+    """Обработчик журнала с очередью и фоновым писателем.
+
+    Поток запроса только кладет запись в ограниченную очередь. Писатель
+    забирает записи пачками (до batch_size или раз в flush_interval секунд),
+    форматирует и пишет в файл одним вызовом. Последняя четверть очереди
+    оставлена под записи WARNING и выше: после заполнения на 3/4 записи
+    ниже WARNING отбрасываются (policy='drop') или прореживаются
+    (policy='sample': сохраняется каждая sample_rate-я). Важные записи
+    теряются, только если очередь заполнена целиком; запросы при этом не
+    ждут диска.
+
+    Файл открыт на дозапись, поэтому в один журнал могут писать несколько
+    процессов (воркеры gunicorn); после fork писатель перезапускается.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5, queue_size=10000,
+                 batch_size=500, flush_interval=1.0, policy='drop', sample_rate=10, echo=False):
+        super().__init__()
+        if policy not in ('drop', 'sample'):
+            raise ValueError(f"Неизвестная политика переполнения: {policy}")
+        self.file = _RotatingFile(path, max_bytes, backup_count)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.echo = echo
+        self.dropped = 0
+        self._sampled = 0
+        self._high_water = queue_size * 3 // 4
+        self._start_writer()
+        atexit.register(self.close)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _start_writer(self):
+        self._stop = threading.Event()
+        self._writer = threading.Thread(target=self._run, name=f'log-writer:{self.file.path}', daemon=True)
+        self._writer.start()
+
+    def _after_fork(self):
+        # потоки не переживают fork: записи из очереди родителя допишет родитель,
+        # а дочернему процессу нужны своя очередь, свой поток и свой файл
+        if self._stop.is_set():
+            return
+        self.createLock()
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.file.reopen()
+        self._start_writer()
+
+    def emit(self, record):
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self._high_water:
+            if self.policy == 'drop':
+                self.dropped += 1
+                return
+            self._sampled += 1
+            if self._sampled % self.sample_rate:
+                self.dropped += 1
+                return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self, first):
+        batch = [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.format(record) + '\n')
+            except Exception:
+                self.handleError(record)
+        text = ''.join(lines)
+        try:
+            self.file.write(text)
+            if self.echo:
+                sys.stderr.write(text)
+        except Exception:
+            self.handleError(batch[-1])
+
+    def _run(self):
+        while not (self._stop.is_set() and self.queue.empty()):
+            try:
+                first = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+            if self.queue.qsize() < self.batch_size and not self._stop.is_set():
+                # копим следующую пачку, а не пишем по одной записи
+                time.sleep(min(self.flush_interval, 0.05))
+
+    def close(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            self._writer.join(timeout=5)
+            self.file.close()
+        super().close()
@@ -1,28 +1,19 @@
 # logger.py
 import logging
-import json
-from datetime import datetime
 
+from .store import MetricStore
+
+logger = logging.getLogger('minutely_metrics')
 
-class MetricLogger:
-    def __init__(self):
-        self.logger = logging.getLogger('minutely_metrics')
-        self.logger.setLevel(logging.INFO)
 
-        # Настройка обработчика для записи в файл
-        handler = logging.FileHandler('minutely_metrics.log')
-        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
-        self.logger.addHandler(handler)
+class MetricLogger:
+    def __init__(self, store=None):
+        # Снимки пишутся ровно один раз - в журнал MetricStore
+        self.store = store or MetricStore()
 
     def log_metrics(self, metrics):
         try:
-            log_data = {
-                'timestamp': metrics['timestamp'],
-                'metrics': metrics['metrics']
-            }
-
-            # Логируем в JSON формате для удобства последующего анализа
-            self.logger.info(json.dumps(log_data, indent=2, ensure_ascii=False))
+            self.store.append(metrics['timestamp'], metrics['metrics'])
 
             # Дополнительно выводим ключевые метрики в консоль
             print(f"\n=== Minutely Metrics [{metrics['metrics']['current_minute']}] ===")
@@ -33,5 +24,5 @@ class MetricLogger:
             print(f"Errors: {metrics['metrics']['errors_last_min']}")
 
         except Exception as e:
-            self.logger.error(f"Failed to log metrics: {str(e)}")
-            print(f"Error logging metrics: {str(e)}")
\ No newline at end of file
+            logger.error(f"Failed to log metrics: {str(e)}")
+            print(f"Error logging metrics: {str(e)}")
@@ -1,33 +1,108 @@
+import os
+import signal
+import sys
+
+if __name__ == '__main__':
+    # запуск файлом (python metrics/scheduler.py): пакеты проекта лежат уровнем выше
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from datetime import timedelta
+from datetime import datetime, timedelta
 from data import db_session
+from metrics.leader import LeaderLease
+
+LEASE_NAME = 'scheduler'
+LEASE_TTL = int(os.getenv('SCHEDULER_LEASE_TTL', 60))  # секунд
+
+
+def init_scheduler(app, scheduler=None, jobs=()):
+    """Инициализация планировщика метрик.
 
+    Ежеминутный сбор метрик и задачи из jobs - пары (функция, параметры
+    интервала) - выполняет только держатель аренды LEASE_NAME, сколько бы
+    процессов ни запустило планировщик. Возвращает (scheduler, lease);
+    BackgroundScheduler запускается сразу, прочие - вызывающим.
+    """
+    if scheduler is None:
+        scheduler = BackgroundScheduler(daemon=True)
 
-def init_scheduler(app):
-    """Инициализация планировщика метрик"""
-    scheduler = BackgroundScheduler(daemon=True)
+    from metrics.logger import MetricLogger
+    from metrics.store import MetricStore
+
+    lease = LeaderLease(LEASE_NAME, ttl=LEASE_TTL)
+
+    # один логгер на все запуски задачи
+    metric_logger = MetricLogger(MetricStore(app.config.get('METRICS_STORE_FILE', 'logs/minutely_metrics.ndjson')))
 
     def collect_and_log():
         with app.app_context():
             db_sess = db_session.create_session()
             try:
-                from .collector import MetricsCollector
-                from .logger import MetricLogger
+                from metrics.collector import MetricsCollector
+                from data.rollups import prune_rollups
 
                 metrics = MetricsCollector.collect_all(db_sess)
-                logger = MetricLogger()
-                logger.log_metrics(metrics)
+                metric_logger.log_metrics(metrics)
+
+                write_sess = db_session.create_write_session()
+                try:
+                    prune_rollups(write_sess)
+                finally:
+                    write_sess.close()
             except Exception as e:
                 app.logger.error(f"Metrics collection error: {str(e)}")
             finally:
                 db_sess.close()
 
+    # аренду продлеваем чаще, чем она истекает; первый захват - до старта задач
+    lease.renew()
+    scheduler.add_job(
+        lease.renew,
+        trigger=IntervalTrigger(seconds=lease.renew_interval),
+        id='leader_lease',
+        replace_existing=True
+    )
     scheduler.add_job(
-        collect_and_log,
+        lease.leader_only(collect_and_log),
         trigger=IntervalTrigger(minutes=1),
         id='metrics_collection',
-        replace_existing=True
+        replace_existing=True,
+        coalesce=True
     )
+    for func, interval in jobs:
+        scheduler.add_job(
+            lease.leader_only(func),
+            trigger=IntervalTrigger(**interval),
+            id=func.__name__,
+            replace_existing=True,
+            coalesce=True,
+            next_run_time=datetime.now() + timedelta(seconds=10)
+        )
+
+    if isinstance(scheduler, BackgroundScheduler):
+        scheduler.start()
+    return scheduler, lease
+
+
+def run_worker():
+    """Отдельный процесс периодических задач (сервис scheduler в docker-compose)"""
+    from main import create_app, scheduled_jobs
+
+    app = create_app(start_scheduler=False)
+    scheduler, lease = init_scheduler(app, BlockingScheduler(), jobs=scheduled_jobs())
+
+    # при остановке контейнера отдаем аренду сразу, не дожидаясь истечения
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Планировщик задач запущен ({lease.holder}, лидер: {lease.is_leader})")
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        lease.release()
+
 
-    scheduler.start()
\ No newline at end of file
+if __name__ == '__main__':
+    run_worker()
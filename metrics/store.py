@@ -0,0 +1,120 @@
+# store.py
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+# Поля, которые при прореживании суммируются, остальные числовые - усредняются
+SUM_FIELDS = {'transactions_last_min', 'new_logins', 'errors_last_min'}
+
+
+class MetricStore:
+    """Журнал минутных метрик: NDJSON с ротацией по размеру.
+
+    Каждая строка - {"ts": ISO-время, "metrics": {...}}. Строки упорядочены
+    по времени, поэтому начало диапазона ищется двоичным поиском по смещению
+    в файле, без разбора всего журнала.
+    """
+
+    def __init__(self, path='logs/minutely_metrics.ndjson', max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def append(self, timestamp, metrics):
+        line = json.dumps({'ts': timestamp, 'metrics': metrics}, ensure_ascii=False, separators=(',', ':')) + '\n'
+        data = line.encode('utf-8')
+        with self._lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+                self._rotate()
+            with open(self.path, 'ab') as f:
+                f.write(data)
+
+    def _rotate(self):
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f'{self.path}.{i}'
+            if os.path.exists(src):
+                os.replace(src, f'{self.path}.{i + 1}')
+        if self.backup_count > 0:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+
+    def _files(self):
+        """Файлы журнала от старых к новым"""
+        files = [f'{self.path}.{i}' for i in range(self.backup_count, 0, -1)]
+        files.append(self.path)
+        return [path for path in files if os.path.exists(path)]
+
+    @staticmethod
+    def _line_ts(line):
+        return datetime.fromisoformat(json.loads(line)['ts'])
+
+    @classmethod
+    def _seek(cls, f, start):
+        """Ставит файл на первую строку с ts >= start (двоичный поиск по байтам)"""
+        lo, hi = 0, os.fstat(f.fileno()).st_size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid)
+            if mid:
+                f.readline()  # пропускаем строку, в которую попали
+            line = f.readline()
+            try:
+                found = not line or cls._line_ts(line) >= start
+            except (ValueError, KeyError):
+                found = False
+            if found:
+                hi = mid
+            else:
+                lo = mid + 1
+        f.seek(lo)
+        if lo:
+            f.readline()
+
+    def read_range(self, start, end=None):
+        """Снимки метрик с ts в [start, end)"""
+        for path in self._files():
+            with open(path, 'rb') as f:
+                self._seek(f, start)
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        ts = datetime.fromisoformat(record['ts'])
+                    except (ValueError, KeyError):
+                        continue
+                    if ts < start:
+                        continue
+                    if end is not None and ts >= end:
+                        return
+                    yield ts, record['metrics']
+
+    def downsample(self, start, end=None, step=timedelta(minutes=1)):
+        """Прореженный ряд: по одной точке на интервал step"""
+        buckets = {}
+        for ts, metrics in self.read_range(start, end):
+            key = start + ((ts - start) // step) * step
+            bucket = buckets.setdefault(key, {'samples': 0, 'values': {}})
+            bucket['samples'] += 1
+            for name, value in metrics.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    bucket['values'][name] = bucket['values'].get(name, 0) + value
+
+        series = []
+        for key in sorted(buckets):
+            samples = buckets[key]['samples']
+            point = {'timestamp': key.isoformat(), 'samples': samples}
+            for name, total in buckets[key]['values'].items():
+                point[name] = total if name in SUM_FIELDS else round(total / samples, 2)
+            series.append(point)
+        return series
+
+    def last_hour(self, now=None):
+        now = now or datetime.now()
+        return self.downsample(now - timedelta(hours=1), now, timedelta(minutes=1))
+
+    def last_day(self, now=None):
+        now = now or datetime.now()
+        return self.downsample(now - timedelta(days=1), now, timedelta(minutes=15))
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from typing import Any, Callable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Объединение одновременных запросов в пачки для одного вызова process.
+
+    Первый запрос открывает окно в window секунд; все, что пришло за это
+    время (но не больше max_batch), уходит одним вызовом process(items) в
+    рабочем потоке. Пока пачка считается, новые запросы копятся в следующую,
+    поэтому под нагрузкой пачки растут сами, а event loop не блокируется.
+    process должен вернуть результаты в порядке входных элементов.
+    """
+
+    def __init__(self, process: Callable[[List[Any]], Sequence[Any]], window: float = 0.005,
+                 max_batch: int = 32):
+        self.process = process
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.items = 0
+        self._pending: List[tuple] = []  # (элемент, future)
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._busy = False
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._dispatch()
+        elif self._timer is None and not self._busy:
+            self._timer = loop.call_later(self.window, self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._busy or not self._pending:
+            return
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        self._busy = True
+        asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: List[tuple]):
+        try:
+            results = await asyncio.to_thread(self.process, [item for item, _ in batch])
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.batches += 1
+            self.items += len(batch)
+            self._busy = False
+            # накопившееся за время расчета уходит сразу, без нового окна
+            self._dispatch()
@@ -1,25 +1,36 @@
+from startup import StartupTimer
+
+startup = StartupTimer()
+
 import os
+import asyncio
+import random
 import logging
 import json
-from typing import Optional, Dict
-from collections import defaultdict
+import hashlib
+import shutil
+import threading
+from typing import AsyncIterator, Optional, Dict
+import time
+from collections import defaultdict, OrderedDict
 from datetime import datetime
-from gigachat import GigaChat
-from gigachat.models import Chat, Messages, MessagesRole
+import numpy as np
 
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
 from aiogram.fsm.storage.memory import MemoryStorage
+from fsm_storage import SQLiteStorage
+from webhook import WebhookServer, run_webhook
+from batching import MicroBatcher
+from streaming import StreamingReply, split_message
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.enums import ParseMode
 from aiogram.utils.markdown import html_decoration as hd
 
-# Для работы с PDF
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
+# langchain, FAISS, модель эмбеддингов и клиент GigaChat импортируются лениво:
+# меню и калькулятор работают сразу, база знаний догружается в фоне
+startup.mark("imports")
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -30,28 +41,88 @@ API_TOKEN = "7810891694:AAFQWbhhUd28qQa7Iutt5-k5oOewOnzUz88"
 GIGACHAT_CREDENTIALS = "MTlmNjg5ZTYtNzRhNS00NzFjLTg4NzEtM2I2OThmNDdkNTk4OmY3OWJkODU0LTRiMGUtNDg3ZC1iMzEzLTNlODc4ZjYxNGRmZQ=="
 METRICS_FILE = "metrics.json"  # Файл для хранения метрик
 
+# Состояния FSM: общий SQLite файл для всех процессов бота; пустой путь - в памяти
+FSM_STORAGE_PATH = os.getenv("FSM_STORAGE_PATH", "data/fsm_states.sqlite3")
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", 24 * 3600))  # секунд без изменений до удаления
+FSM_COMMIT_WINDOW = float(os.getenv("FSM_COMMIT_WINDOW", 0.01))  # секунд на сбор пачки записей
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_PUBLIC_URL = os.getenv("WEBHOOK_PUBLIC_URL")  # без него setWebhook не вызывается
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", 100))  # принятых, но не обработанных
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 30))  # секунд на дообработку при остановке
+WEBHOOK_RECORD_FILE = os.getenv("WEBHOOK_RECORD_FILE")  # NDJSON с принятыми обновлениями для replay
+
 # Инициализация бота
 bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+if FSM_STORAGE_PATH:
+    storage = SQLiteStorage(FSM_STORAGE_PATH, ttl=FSM_STATE_TTL, commit_window=FSM_COMMIT_WINDOW)
+else:
+    storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 
 # Инициализация GigaChat
-gigachat = GigaChat(credentials=GIGACHAT_CREDENTIALS, verify_ssl_certs=False)
+GIGACHAT_CONCURRENCY = int(os.getenv("GIGACHAT_CONCURRENCY", 4))  # одновременных запросов к LLM
+GIGACHAT_TIMEOUT = float(os.getenv("GIGACHAT_TIMEOUT", 60))  # секунд на один запрос
+GIGACHAT_RETRIES = max(1, int(os.getenv("GIGACHAT_RETRIES", 3)))  # всего попыток, включая первую
+GIGACHAT_RETRY_BACKOFF = float(os.getenv("GIGACHAT_RETRY_BACKOFF", 1.0))
+# ответ выводится по мере генерации правками одного сообщения
+ANSWER_STREAMING = os.getenv("ANSWER_STREAMING", "True") == "True"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", 1.0))  # секунд между правками сообщения
+STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", 40))  # новых символов для очередной правки
+
+gigachat = None  # создается при первом обращении (get_gigachat)
+gigachat_lock = threading.Lock()
+gigachat_semaphore: Optional[asyncio.Semaphore] = None  # создается в работающем event loop
+
+
+def get_gigachat():
+    global gigachat
+    if gigachat is None:
+        with gigachat_lock:
+            if gigachat is None:
+                from gigachat import GigaChat
+                gigachat = GigaChat(credentials=GIGACHAT_CREDENTIALS, verify_ssl_certs=False,
+                                    timeout=GIGACHAT_TIMEOUT)
+    return gigachat
 
 
 # МЕТРИКИ: Хранение популярных вопросов
+METRICS_FLUSH_SIZE = int(os.getenv("METRICS_FLUSH_SIZE", 50))  # событий в пачке
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))  # секунд
+METRICS_COMPACT_INTERVAL = float(os.getenv("METRICS_COMPACT_INTERVAL", 600))  # секунд
+
+
 class QuestionMetrics:
+    """Счетчики вопросов: снимок в filename + журнал событий filename.log.
+
+    Новые вопросы копятся в памяти и дописываются в журнал пачками,
+    периодически журнал сворачивается в снимок.
+    """
+
     def __init__(self, filename: str = METRICS_FILE):
         self.filename = filename
+        self.log_filename = f"{filename}.log"
+        self.old_log_filename = f"{filename}.log.old"
         self.question_counts = defaultdict(int)
         self.last_updated = None
+        self.seq = 0  # номер последнего события
+        self.snapshot_seq = 0  # номер последнего события, попавшего в снимок
+        self.pending = []
         self.load_metrics()
 
     def add_question(self, question: str):
         normalized_question = question.lower().strip()
         self.question_counts[normalized_question] += 1
         self.last_updated = datetime.now()
-        self.save_metrics()
+        self.seq += 1
+        self.pending.append({"seq": self.seq, "q": normalized_question, "ts": self.last_updated.isoformat()})
+        if len(self.pending) >= METRICS_FLUSH_SIZE:
+            self.flush()
 
     def get_top_questions(self, n: int = 5) -> Dict[str, int]:
         sorted_questions = sorted(
@@ -61,17 +132,69 @@ class QuestionMetrics:
         )
         return dict(sorted_questions[:n])
 
-    def save_metrics(self):
+    def flush(self):
+        """Дописывает накопленные события в журнал"""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+        try:
+            with open(self.log_filename, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in batch))
+        except Exception as e:
+            self.pending = batch + self.pending
+            logger.error(f"Error flushing metrics: {e}")
+
+    def _snapshot_data(self) -> dict:
+        """Сбрасывает буфер, откладывает текущий журнал и фиксирует состояние для снимка"""
+        self.flush()
+        # Если предыдущее сворачивание не завершилось, старый журнал еще не удален:
+        # оставляем текущий журнал на месте, его события отсеются по seq при загрузке
+        if os.path.exists(self.log_filename) and not os.path.exists(self.old_log_filename):
+            os.replace(self.log_filename, self.old_log_filename)
+        return {
+            "question_counts": dict(self.question_counts),
+            "last_updated": self.last_updated.isoformat() if self.last_updated else None,
+            "seq": self.seq
+        }
+
+    def _write_snapshot(self, data: dict):
         try:
-            data = {
-                "question_counts": dict(self.question_counts),
-                "last_updated": self.last_updated.isoformat() if self.last_updated else None
-            }
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            tmp_filename = f"{self.filename}.tmp"
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, self.filename)
+            self.snapshot_seq = data["seq"]
+            # отложенный журнал целиком вошел в снимок
+            if os.path.exists(self.old_log_filename):
+                os.remove(self.old_log_filename)
         except Exception as e:
             logger.error(f"Error saving metrics: {e}")
 
+    def save_metrics(self):
+        """Сворачивает журнал в снимок (синхронно)"""
+        self._write_snapshot(self._snapshot_data())
+
+    async def compact(self):
+        """Сворачивает журнал в снимок, запись файла - в отдельном потоке"""
+        if self.seq == self.snapshot_seq:
+            return
+        await asyncio.to_thread(self._write_snapshot, self._snapshot_data())
+
+    async def run_writer(self):
+        """Фоновая запись: пачки по таймеру и периодическое сворачивание журнала"""
+        last_compact = time.monotonic()
+        try:
+            while True:
+                await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+                self.flush()
+                if time.monotonic() - last_compact >= METRICS_COMPACT_INTERVAL:
+                    await self.compact()
+                    last_compact = time.monotonic()
+        finally:
+            self.save_metrics()
+
     def load_metrics(self):
         try:
             if os.path.exists(self.filename):
@@ -80,13 +203,110 @@ class QuestionMetrics:
                     self.question_counts = defaultdict(int, data.get("question_counts", {}))
                     last_updated = data.get("last_updated")
                     self.last_updated = datetime.fromisoformat(last_updated) if last_updated else None
+                    self.seq = self.snapshot_seq = data.get("seq", 0)
         except Exception as e:
             logger.error(f"Error loading metrics: {e}")
 
+        # Дочитываем события, не попавшие в снимок
+        for log_filename in (self.old_log_filename, self.log_filename):
+            try:
+                if os.path.exists(log_filename):
+                    with open(log_filename, 'r', encoding='utf-8') as f:
+                        for line in f:
+                            try:
+                                event = json.loads(line)
+                            except ValueError:
+                                continue  # оборванная при сбое последняя строка
+                            if event["seq"] <= self.seq:
+                                continue
+                            self.question_counts[event["q"]] += 1
+                            self.seq = event["seq"]
+                            self.last_updated = datetime.fromisoformat(event["ts"])
+            except Exception as e:
+                logger.error(f"Error replaying metrics log {log_filename}: {e}")
+
 
 metrics = QuestionMetrics()
 
 
+# КЭШ ОТВЕТОВ: точное совпадение по нормализованному вопросу + семантически близкие вопросы
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", 24 * 60 * 60))  # секунд
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.92))  # порог косинусной близости
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+class AnswerCache:
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl: int = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.entries = OrderedDict()  # вопрос -> (ответ, нормированный вектор, время записи)
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._matrix = None
+        self._matrix_keys = []
+
+    def _alive(self, key: str) -> bool:
+        created_at = self.entries[key][2]
+        if time.monotonic() - created_at > self.ttl:
+            del self.entries[key]
+            self._matrix = None
+            return False
+        return True
+
+    def get(self, question: str) -> Optional[str]:
+        """Первый уровень: точное совпадение нормализованного вопроса"""
+        key = normalize_question(question)
+        if key in self.entries and self._alive(key):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key][0]
+        return None
+
+    def get_similar(self, vector) -> Optional[str]:
+        """Второй уровень: ближайший закэшированный вопрос по эмбеддингу"""
+        if self._matrix is None:
+            self._matrix_keys = list(self.entries.keys())
+            self._matrix = np.vstack([self.entries[k][1] for k in self._matrix_keys]) if self._matrix_keys else None
+        if self._matrix is not None:
+            scores = self._matrix @ self._normalize(vector)
+            best = int(np.argmax(scores))
+            key = self._matrix_keys[best]
+            if scores[best] >= self.threshold and key in self.entries and self._alive(key):
+                self.entries.move_to_end(key)
+                self.semantic_hits += 1
+                return self.entries[key][0]
+        self.misses += 1
+        return None
+
+    def put(self, question: str, vector, answer: str):
+        key = normalize_question(question)
+        self.entries[key] = (answer, self._normalize(vector), time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        self._matrix = None
+
+    def clear(self):
+        self.entries.clear()
+        self._matrix = None
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+answer_cache = AnswerCache()
+
+
 # Состояния для FSM
 class WasteCalculation(StatesGroup):
     waiting_for_waste_class = State()
@@ -98,14 +318,30 @@ class AdminCommands(StatesGroup):
 
 
 # Загрузка и обработка PDF документов
+PDF_PATHS = [
+    "data/registration_guide.pdf",
+    "data/digital_signature_manual.pdf"
+]
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hf")  # hf или onnx (int8, без torch)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", 0))  # 0 - по числу ядер
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "data/onnx_model")
+KNOWLEDGE_BASE_WAIT = float(os.getenv("KNOWLEDGE_BASE_WAIT", 30))  # секунд ожидания загрузки в запросе
+SEARCH_K = 3  # фрагментов документации в контексте ответа
+QUERY_BATCH_WINDOW = float(os.getenv("QUERY_BATCH_WINDOW_MS", 5)) / 1000  # окно сбора вопросов в пачку
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", 32))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "data/faiss_index")
+INDEX_META_FILE = "index_meta.json"
+
+
 def load_documents():
-    pdf_paths = [
-        "data/registration_guide.pdf",
-        "data/digital_signature_manual.pdf"
-    ]
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
 
     docs = []
-    for path in pdf_paths:
+    for path in PDF_PATHS:
         try:
             loader = PyPDFLoader(path)
             docs.extend(loader.load())
@@ -113,22 +349,162 @@ def load_documents():
             logger.error(f"Failed to load {path}: {e}")
 
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP
     )
     return text_splitter.split_documents(docs)
 
 
-# Инициализация векторного хранилища
-try:
-    documents = load_documents()
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-    )
-    vector_db = FAISS.from_documents(documents, embeddings)
-except Exception as e:
-    logger.error(f"Vector DB initialization failed: {e}")
-    raise
+def sources_fingerprint() -> str:
+    """Хэш исходных PDF и параметров индексации"""
+    digest = hashlib.sha256()
+    digest.update(f"{EMBEDDING_MODEL}|{EMBEDDING_BACKEND}|{CHUNK_SIZE}|{CHUNK_OVERLAP}".encode())
+    for path in PDF_PATHS:
+        digest.update(path.encode())
+        try:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        except OSError:
+            digest.update(b'<missing>')
+    return digest.hexdigest()
+
+
+def _read_index_meta() -> Optional[dict]:
+    try:
+        with open(os.path.join(INDEX_DIR, INDEX_META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _load_saved_index(embeddings):
+    from langchain_community.vectorstores import FAISS
+
+    return FAISS.load_local(INDEX_DIR, embeddings, allow_dangerous_deserialization=True)
+
+
+def _save_index(db, fingerprint: str):
+    """Атомарно сохраняет индекс вместе с метаданными"""
+    tmp_dir = f"{INDEX_DIR}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    db.save_local(tmp_dir)
+    with open(os.path.join(tmp_dir, INDEX_META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            "fingerprint": fingerprint,
+            "embedding_model": EMBEDDING_MODEL,
+            "embedding_backend": EMBEDDING_BACKEND,
+            "built_at": datetime.now().isoformat()
+        }, f, ensure_ascii=False)
+    shutil.rmtree(INDEX_DIR, ignore_errors=True)
+    os.replace(tmp_dir, INDEX_DIR)
+
+
+def build_vector_db(embeddings):
+    """Загружает сохраненный индекс или пересобирает его при изменении PDF.
+
+    Возвращает (индекс, пересобран ли он).
+    """
+    fingerprint = sources_fingerprint()
+    meta = _read_index_meta()
+    if meta and meta.get("fingerprint") == fingerprint:
+        try:
+            db = _load_saved_index(embeddings)
+            logger.info(f"Loaded FAISS index from {INDEX_DIR}")
+            return db, False
+        except Exception as e:
+            logger.warning(f"Saved FAISS index is unreadable, rebuilding: {e}")
+
+    from langchain_community.vectorstores import FAISS
+
+    logger.info("Building FAISS index from PDF documents...")
+    db = FAISS.from_documents(load_documents(), embeddings)
+    try:
+        _save_index(db, fingerprint)
+    except Exception as e:
+        logger.error(f"Failed to persist FAISS index: {e}")
+    return db, True
+
+
+def search_by_vectors(db, vectors, k: int):
+    """Поиск k ближайших фрагментов сразу для матрицы запросов одним вызовом FAISS"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if getattr(db, "_normalize_L2", False):
+        import faiss
+        faiss.normalize_L2(vectors)
+    _, ids = db.index.search(vectors, k)
+    results = []
+    for row in ids:
+        # -1 - в индексе меньше k векторов
+        results.append([db.docstore.search(db.index_to_docstore_id[i]) for i in row if i != -1])
+    return results
+
+
+class KnowledgeBase:
+    """Модель эмбеддингов и FAISS индекс, загружаемые в фоновом потоке после старта"""
+
+    def __init__(self):
+        self.embeddings = None
+        self.vector_db = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._load_async())
+
+    async def _load_async(self):
+        try:
+            embeddings, vector_db, rebuilt = await asyncio.to_thread(self._load)
+        except Exception as e:
+            logger.error(f"Vector DB initialization failed: {e}")
+            self._task = None  # следующий запрос повторит загрузку
+            raise
+        finally:
+            startup.report("Knowledge base startup")
+        if rebuilt:
+            # ответы, полученные по старому индексу, больше не актуальны;
+            # кэш ответов не потокобезопасен, поэтому чистим его в event loop
+            answer_cache.clear()
+        self.embeddings, self.vector_db = embeddings, vector_db
+
+    def _load(self):
+        from embeddings import load_embeddings
+
+        with startup.phase(f"embeddings ({EMBEDDING_BACKEND})"):
+            embeddings = load_embeddings(EMBEDDING_BACKEND, EMBEDDING_MODEL, ONNX_MODEL_DIR, EMBEDDING_THREADS)
+            embeddings.embed_query("прогрев модели")
+        with startup.phase("vector index"):
+            vector_db, rebuilt = build_vector_db(embeddings)
+        with startup.phase("gigachat client"):
+            get_gigachat()
+        return embeddings, vector_db, rebuilt
+
+    @property
+    def ready(self) -> bool:
+        return self.vector_db is not None
+
+    def embed_and_search(self, questions):
+        """Эмбеддинги пачки вопросов одним проходом модели и пакетный поиск по индексу"""
+        vectors = np.asarray(self.embeddings.embed_documents(questions), dtype=np.float32)
+        return list(zip(vectors, search_by_vectors(self.vector_db, vectors, SEARCH_K)))
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Ждет загрузки не дольше timeout секунд; ошибка загрузки пробрасывается"""
+        if self.ready:
+            return True
+        self.start()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return self.ready
+
+
+knowledge_base = KnowledgeBase()
+
+# одновременные вопросы считаются пачками: (вектор вопроса, найденные фрагменты)
+query_batcher = MicroBatcher(knowledge_base.embed_and_search, window=QUERY_BATCH_WINDOW,
+                             max_batch=QUERY_BATCH_MAX)
 
 
 # Клавиатуры
@@ -144,24 +520,89 @@ def main_menu_keyboard():
     )
 
 
+def _gigachat_semaphore() -> asyncio.Semaphore:
+    global gigachat_semaphore
+    if gigachat_semaphore is None:
+        gigachat_semaphore = asyncio.Semaphore(GIGACHAT_CONCURRENCY)
+    return gigachat_semaphore
+
+
+async def _gigachat_request(chat):
+    """Один вызов GigaChat с ограничением параллелизма и таймаутом"""
+    async with _gigachat_semaphore():
+        return await asyncio.wait_for(get_gigachat().achat(chat), timeout=GIGACHAT_TIMEOUT)
+
+
+def _build_chat(question: str, context: str):
+    from gigachat.models import Chat, Messages, MessagesRole
+
+    messages = Messages(
+        role=MessagesRole.USER,
+        content=f"Контекст:\n{context}\n\nВопрос: {question}\n\nОтветь строго по предоставленным документам. Если информации нет, скажи 'Информация не найдена'."
+    )
+    return Chat(
+        messages=[messages],
+        temperature=0.3,
+        max_tokens=1000
+    )
+
+
+async def _retry_pause(attempt: int):
+    # экспоненциальная задержка со случайным разбросом
+    delay = GIGACHAT_RETRY_BACKOFF * 2 ** (attempt - 1)
+    await asyncio.sleep(random.uniform(0, delay))
+
+
 async def ask_gigachat(question: str, context: str) -> Optional[str]:
-    try:
-        messages = Messages(
-            role=MessagesRole.USER,
-            content=f"Контекст:\n{context}\n\nВопрос: {question}\n\nОтветь строго по предоставленным документам. Если информации нет, скажи 'Информация не найдена'."
-        )
+    chat = _build_chat(question, context)
 
-        response = gigachat.chat(
-            Chat(
-                messages=[messages],
-                temperature=0.3,
-                max_tokens=1000
-            )
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        logger.error(f"GigaChat API error: {e}")
-        return None
+    for attempt in range(1, GIGACHAT_RETRIES + 1):
+        try:
+            response = await _gigachat_request(chat)
+            return response.choices[0].message.content
+        except Exception as e:
+            logger.error(f"GigaChat API error (attempt {attempt}/{GIGACHAT_RETRIES}): {e!r}")
+            if attempt == GIGACHAT_RETRIES:
+                return None
+            await _retry_pause(attempt)
+
+
+async def stream_gigachat(question: str, context: str) -> AsyncIterator[str]:
+    """Ответ GigaChat фрагментами по мере генерации.
+
+    Повтор запроса возможен, только пока не получено ни одного фрагмента;
+    GIGACHAT_TIMEOUT ограничивает ожидание каждого следующего фрагмента.
+    """
+    chat = _build_chat(question, context)
+
+    for attempt in range(1, GIGACHAT_RETRIES + 1):
+        received = False
+        try:
+            async with _gigachat_semaphore():
+                chunks = get_gigachat().astream(chat).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=GIGACHAT_TIMEOUT)
+                    except StopAsyncIteration:
+                        return
+                    piece = chunk.choices[0].delta.content if chunk.choices else None
+                    if piece:
+                        received = True
+                        yield piece
+        except Exception as e:
+            logger.error(f"GigaChat stream error (attempt {attempt}/{GIGACHAT_RETRIES}): {e!r}")
+            if received or attempt == GIGACHAT_RETRIES:
+                raise
+            await _retry_pause(attempt)
+
+
+def format_answer(answer: str) -> str:
+    """Окончательный HTML ответа; текст модели экранируется"""
+    return (
+        f"📄 <b>Ответ по вашему запросу:</b>\n\n"
+        f"{hd.quote(answer)}\n\n"
+        f"<i>Информация основана на официальных документах ФГИС ОПВК</i>"
+    )
 
 
 # Обработчики команд
@@ -211,6 +652,13 @@ async def process_admin_password(message: types.Message, state: FSMContext):
 
             response += f"\nПоследнее обновление: {metrics.last_updated}"
 
+        response += (
+            f"\n\nКэш ответов: {len(answer_cache.entries)} записей, "
+            f"попаданий {answer_cache.hits} (+{answer_cache.semantic_hits} похожих), "
+            f"промахов {answer_cache.misses}"
+            f"\nПоиск по документации: {query_batcher.items} вопросов в {query_batcher.batches} пачках"
+        )
+
         await message.answer(response, parse_mode=ParseMode.HTML)
     else:
         await message.answer("Неверный пароль администратора.")
@@ -325,23 +773,38 @@ async def handle_text_query(message: types.Message, state: FSMContext):
 
     metrics.add_question(query)
 
+    reply = None
     try:
-        await bot.send_chat_action(message.chat.id, "typing")
-        docs = vector_db.similarity_search(query, k=3)
-        context = "\n\n---\n\n".join([d.page_content for d in docs])
-        answer = await ask_gigachat(
-            question=query,
-            context=f"Документация ФГИС ОПВК:\n{context}"
-        )
-
-        if not answer:
-            raise ValueError("Пустой ответ от GigaChat API")
-
-        response = (
-            f"📄 <b>Ответ по вашему запросу:</b>\n\n"
-            f"{answer}\n\n"
-            f"<i>Информация основана на официальных документах ФГИС ОПВК</i>"
-        )
+        answer = answer_cache.get(query)
+        if answer is None:
+            await bot.send_chat_action(message.chat.id, "typing")
+            if not await knowledge_base.wait_ready(KNOWLEDGE_BASE_WAIT):
+                await message.answer(
+                    "⏳ База знаний еще загружается, повторите вопрос через минуту.",
+                    reply_markup=main_menu_keyboard()
+                )
+                return
+            # эмбеддинг и поиск - пачкой с другими вопросами, в рабочем потоке
+            query_vector, docs = await query_batcher.submit(query)
+            answer = answer_cache.get_similar(query_vector)
+
+        if answer is None:
+            context = "\n\n---\n\n".join([d.page_content for d in docs])
+            context = f"Документация ФГИС ОПВК:\n{context}"
+            if ANSWER_STREAMING:
+                reply = StreamingReply(bot, message.chat.id, edit_interval=STREAM_EDIT_INTERVAL,
+                                       min_chars=STREAM_MIN_CHARS)
+                # без клавиатуры: сообщения с обычной клавиатурой Telegram не дает править
+                await reply.start("⏳ Готовлю ответ...")
+                answer = await reply.consume(stream_gigachat(query, context))
+            else:
+                answer = await ask_gigachat(question=query, context=context)
+
+            if not answer:
+                raise ValueError("Пустой ответ от GigaChat API")
+            answer_cache.put(query, query_vector, answer)
+
+        response = format_answer(answer)
 
     except Exception as e:
         logger.error(f"Error processing query: {e}")
@@ -353,8 +816,14 @@ async def handle_text_query(message: types.Message, state: FSMContext):
             "3. Повторить попытку позже"
         )
 
+    if reply is not None:
+        await reply.finish(response, parse_mode=ParseMode.HTML, reply_markup=main_menu_keyboard())
+        return
+    parts = split_message(response)
+    for part in parts[:-1]:
+        await message.answer(part, parse_mode=ParseMode.HTML)
     await message.answer(
-        response,
+        parts[-1],
         reply_markup=main_menu_keyboard(),
         parse_mode=ParseMode.HTML
     )
@@ -363,10 +832,27 @@ async def handle_text_query(message: types.Message, state: FSMContext):
 # Запуск бота
 async def main():
     logger.info("Starting bot...")
-    await dp.start_polling(bot)
+    metrics_writer = asyncio.create_task(metrics.run_writer())
+    knowledge_base.start()
+    startup.mark("bot ready")
+    try:
+        if BOT_MODE == "webhook":
+            server = WebhookServer(
+                dp, bot,
+                path=WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                max_in_flight=WEBHOOK_MAX_IN_FLIGHT,
+                drain_timeout=WEBHOOK_DRAIN_TIMEOUT,
+                record_file=WEBHOOK_RECORD_FILE
+            )
+            await run_webhook(dp, bot, WEBHOOK_HOST, WEBHOOK_PORT, server, public_url=WEBHOOK_PUBLIC_URL)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        metrics_writer.cancel()
+        await asyncio.gather(metrics_writer, return_exceptions=True)
+        await storage.close()
 
 
 if __name__ == "__main__":
-    import asyncio
-
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""Бэкенды эмбеддингов для FAISS индекса бота.
+
+hf   - HuggingFaceEmbeddings (sentence-transformers на torch), как раньше.
+onnx - та же модель, экспортированная в ONNX и квантованная в int8; на CPU
+       считается быстрее и занимает меньше памяти, torch в процессе бота не
+       нужен. Экспорт выполняется один раз (нужны optimum[exporters] и torch),
+       дальше достаточно onnxruntime и transformers (токенизатор).
+"""
+import logging
+import os
+import shutil
+from typing import List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKENDS = ("hf", "onnx")
+
+
+def load_embeddings(backend: str, model_name: str, onnx_dir: str = "data/onnx_model", threads: int = 0):
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    if backend == "onnx":
+        return OnnxEmbeddings(model_name, onnx_dir, threads=threads)
+
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_name)
+
+
+def export_onnx_model(model_name: str, model_dir: str, quantize: bool = True) -> str:
+    """Разовый экспорт модели в ONNX с динамической int8 квантизацией весов"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    logger.info(f"Exporting {model_name} to ONNX in {model_dir}...")
+    tmp_dir = f"{model_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(tmp_dir)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_dir)
+    if quantize:
+        quantize_dynamic(
+            os.path.join(tmp_dir, "model.onnx"),
+            os.path.join(tmp_dir, "model_quantized.onnx"),
+            weight_type=QuantType.QInt8
+        )
+    shutil.rmtree(model_dir, ignore_errors=True)
+    os.replace(tmp_dir, model_dir)
+    return model_dir
+
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # FAISS из langchain принимает любой объект с embed_query/embed_documents
+    Embeddings = object
+
+
+class OnnxEmbeddings(Embeddings):
+    """Эмбеддинги sentence-transformers (mean pooling) на onnxruntime"""
+
+    def __init__(self, model_name: str, model_dir: str, quantize: bool = True, batch_size: int = 32,
+                 max_length: int = 256, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_file = os.path.join(model_dir, "model_quantized.onnx" if quantize else "model.onnx")
+        if not os.path.exists(model_file):
+            export_onnx_model(model_name, model_dir, quantize=quantize)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(model_file, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = self.tokenizer(
+                texts[start:start + self.batch_size],
+                padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+            )
+            feeds = {name: value.astype(np.int64) for name, value in batch.items() if name in self.input_names}
+            hidden = self.session.run(None, feeds)[0]
+            mask = batch["attention_mask"][..., None].astype(np.float32)
+            vectors.append((hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None))
+        return np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(list(texts)).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
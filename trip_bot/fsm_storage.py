@@ -0,0 +1,317 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+# (state, data, updated_at); updated_at == 0 - записи нет
+Record = Tuple[Optional[str], Dict[str, Any], float]
+EMPTY: Record = (None, {}, 0.0)
+# изменения записи: "state", "data" (замена) и "update" (дополнение data, как dict.update)
+Changes = Dict[str, Any]
+
+
+def _apply(record: Record, changes: Changes, updated_at: float) -> Record:
+    data = changes.get("data", record[1])
+    if "update" in changes:
+        data = {**data, **changes["update"]}
+    return changes.get("state", record[0]), data, updated_at
+
+
+def _merge(pending: Changes, changes: Changes):
+    """Добавляет изменения к еще не записанным изменениям того же ключа"""
+    for field, value in changes.items():
+        if field == "update":
+            if "data" in pending:
+                pending["data"] = {**pending["data"], **value}
+            else:
+                pending["update"] = {**pending.get("update", {}), **value}
+        else:
+            if field == "data":
+                pending.pop("update", None)
+            pending[field] = value
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM хранилище aiogram в локальном файле SQLite (WAL).
+
+    Все обращения к базе идут через одно соединение в отдельном потоке, event
+    loop не блокируется. Записи группируются: изменения за commit_window
+    секунд (или max_batch ключей) фиксируются одной транзакцией, а set_state и
+    set_data возвращают управление после фиксации, так что состояние сразу
+    видно другим процессам бота. set_state, set_data и update_data меняют
+    только свое поле: слияние с остальной записью делается внутри транзакции
+    по свежей строке из базы, поэтому запись другого процесса не затирается
+    устаревшими данными из кэша. Прочитанные состояния (в том числе пустые)
+    держатся в LRU кэше. Перед тем как отдать запись из кэша, PRAGMA
+    data_version проверяет, писал ли в файл другой процесс, и если писал -
+    кэш сбрасывается; так экономится чтение строки и разбор JSON, а не
+    обращение к базе. То же раз в sync_interval секунд делает фоновая задача.
+    Состояния, не менявшиеся дольше ttl секунд, считаются брошенными и
+    удаляются.
+    """
+
+    def __init__(self, path: str, key_builder: Optional[KeyBuilder] = None, ttl: float = 24 * 3600,
+                 commit_window: float = 0.01, max_batch: int = 200, cache_size: int = 10000,
+                 sync_interval: float = 0.05, cleanup_interval: float = 600):
+        self.path = path
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.ttl = ttl
+        self.commit_window = commit_window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.sync_interval = sync_interval
+        self.cleanup_interval = cleanup_interval
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn: Optional[sqlite3.Connection] = None  # живет в потоке executor
+        self._cache: "OrderedDict[str, Record]" = OrderedDict()
+        self._pending: Dict[str, Changes] = {}  # ждут следующей транзакции
+        self._inflight: Dict[str, Changes] = {}  # пишутся сейчас
+        self._waiters = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flushing = False
+        self._data_version = None
+        self._started = None
+        self._sync_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    # --- поток базы данных ---
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm_states ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_fsm_states_updated_at ON fsm_states (updated_at)")
+        self._conn = conn
+        return conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _select(self, key: str) -> Record:
+        row = self._conn.execute(
+            "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return EMPTY
+        return row[0], json.loads(row[1]), row[2]
+
+    def _write_batch(self, batch) -> Dict[str, Record]:
+        """Применяет изменения к текущим строкам в одной транзакции, возвращает новые записи"""
+        records = {}
+        upserts = []
+        deletes = []
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            for key, changes in batch:
+                current = self._select(key)
+                if self._expired(current):
+                    current = EMPTY
+                state, data, updated_at = records[key] = _apply(current, changes, now)
+                if state is not None or data:
+                    upserts.append((key, state, json.dumps(data, ensure_ascii=False), updated_at))
+                else:
+                    deletes.append((key,))
+                    records[key] = EMPTY
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    upserts
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return records
+
+    def _poll_version(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _delete_expired(self, before):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            deleted = self._conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (before,)).rowcount
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return deleted
+
+    def _close_connection(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # --- кэш и группировка записей ---
+
+    async def _ensure_started(self):
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        await self._started
+
+    async def _start(self):
+        self._data_version = await self._run(self._open)
+        self._sync_task = asyncio.create_task(self._sync_loop())
+
+    def _remember(self, key: str, record: Record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _expired(self, record: Record) -> bool:
+        return bool(record[2]) and time.time() - record[2] > self.ttl
+
+    async def _check_version(self):
+        version = await self._run(self._poll_version)
+        if version != self._data_version:
+            # файл менял другой процесс: кэшу больше нельзя доверять
+            self._data_version = version
+            self._cache.clear()
+
+    async def _get(self, key: str) -> Record:
+        await self._ensure_started()
+        if key in self._cache:
+            await self._check_version()
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+        else:
+            record = await self._run(self._select, key)
+            # пока шло чтение, ключ мог быть записан - свежая запись уже в кэше
+            record = self._cache.get(key) or record
+            self._remember(key, record)
+        if self._expired(record):
+            record = EMPTY
+        # еще не зафиксированные изменения этого процесса
+        for changes in (self._inflight.get(key), self._pending.get(key)):
+            if changes:
+                record = _apply(record, changes, time.time())
+        return record
+
+    async def _put(self, key: str, changes: Changes):
+        await self._ensure_started()
+        _merge(self._pending.setdefault(key, {}), changes)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if len(self._pending) >= self.max_batch:
+            self._schedule_flush(0)
+        elif self._flush_handle is None:
+            self._schedule_flush(self.commit_window)
+        # отмена обработчика не должна отменять уже принятую запись
+        await asyncio.shield(waiter)
+
+    def _schedule_flush(self, delay: float):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(delay, lambda: loop.create_task(self._flush()))
+
+    async def _flush(self):
+        self._flush_handle = None
+        if self._flushing or not self._pending:
+            return
+        self._flushing = True
+        self._inflight, self._pending = self._pending, {}
+        waiters, self._waiters = self._waiters, []
+        try:
+            records = await self._run(self._write_batch, list(self._inflight.items()))
+        except Exception as e:
+            logger.error(f"FSM storage write error: {e}")
+            for key in self._inflight:
+                self._cache.pop(key, None)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            for key, record in records.items():
+                self._remember(key, record)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+        finally:
+            self._inflight = {}
+            self._flushing = False
+            if self._pending:
+                # накопилось, пока шла запись
+                self._schedule_flush(0)
+
+    async def _sync_loop(self):
+        last_cleanup = time.monotonic()
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self._check_version()
+                if time.monotonic() - last_cleanup >= self.cleanup_interval:
+                    last_cleanup = time.monotonic()
+                    deleted = await self._run(self._delete_expired, time.time() - self.ttl)
+                    if deleted:
+                        logger.info(f"FSM storage: removed {deleted} abandoned states")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"FSM storage sync error: {e}")
+
+    # --- интерфейс BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._put(self.key_builder.build(key), {"state": state})
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _, _ = await self._get(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._put(self.key_builder.build(key), {"data": data.copy()})
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        # дополнение выполняется в транзакции записи, а не поверх прочитанной копии
+        storage_key = self.key_builder.build(key)
+        await self._put(storage_key, {"update": data.copy()})
+        _, data, _ = await self._get(storage_key)
+        return data.copy()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data, _ = await self._get(self.key_builder.build(key))
+        return data.copy()
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            await asyncio.gather(self._sync_task, return_exceptions=True)
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        while self._pending or self._flushing:
+            await self._flush()
+            await asyncio.sleep(0.01)
+        if self._started is not None:
+            await self._run(self._close_connection)
+        self._executor.shutdown(wait=True)
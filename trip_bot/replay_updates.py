@@ -0,0 +1,63 @@
+"""Отправка записанных обновлений Telegram на локальный webhook.
+
+    python trip_bot/replay_updates.py updates.ndjson --url http://localhost:8080/webhook --concurrency 20
+
+Файл - NDJSON с обновлениями (например, WEBHOOK_RECORD_FILE работающего бота).
+Флаг --renumber выдает обновлениям новые update_id, чтобы один файл можно
+было проигрывать повторно.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+
+async def replay(path, url, concurrency, secret=None, renumber=False, repeat=1):
+    with open(path, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    updates = updates * repeat
+    if renumber:
+        base = int(time.time())
+        for i, update in enumerate(updates):
+            update = dict(update)
+            update["update_id"] = base + i
+            updates[i] = update
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    statuses = {}
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def send(update):
+            async with semaphore:
+                started = time.perf_counter()
+                async with session.post(url, json=update) as response:
+                    await response.read()
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Отправлено {len(updates)} обновлений за {elapsed:.2f} с ({len(updates) / elapsed:.0f}/с)")
+    print(f"Статусы: {statuses}")
+    if latencies:
+        print(f"Задержка ответа p50={latencies[len(latencies) // 2] * 1000:.1f} мс "
+              f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проигрывание записанных обновлений на webhook")
+    parser.add_argument("file")
+    parser.add_argument("--url", default="http://localhost:8080/webhook")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--secret")
+    parser.add_argument("--renumber", action="store_true")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(replay(args.file, args.url, args.concurrency, args.secret, args.renumber, args.repeat))
@@ -0,0 +1,45 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """Длительность фаз запуска бота для отчета в лог.
+
+    mark() закрывает последовательную фазу основного потока (время с
+    предыдущей отметки), phase() замеряет блок кода, в том числе в фоновом
+    потоке загрузки.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []  # (название, секунды, секунды от старта на момент окончания)
+        self._last_mark = self.started
+        self._lock = threading.Lock()
+
+    def _add(self, name, seconds):
+        with self._lock:
+            self.phases.append((name, seconds, time.perf_counter() - self.started))
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self._add(name, now - self._last_mark)
+        self._last_mark = now
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add(name, time.perf_counter() - started)
+
+    def report(self, title="Startup report"):
+        with self._lock:
+            phases = list(self.phases)
+        lines = [f"  {name:<28} {seconds:7.2f} s   (t+{at:.2f} s)" for name, seconds, at in phases]
+        lines.append(f"  {'total':<28} {time.perf_counter() - self.started:7.2f} s")
+        logger.info(f"{title}:\n" + "\n".join(lines))
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from typing import AsyncIterator, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096  # символов в одном сообщении Telegram
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Разбиение длинного текста на сообщения по переносам строк (HTML теги не рвутся)"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+            # не разрезаем HTML сущность вида &amp;
+            amp = text.rfind("&", cut - 8, cut)
+            if amp > 0 and ";" not in text[amp:cut]:
+                cut = amp
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    parts.append(text)
+    return parts
+
+
+class StreamingReply:
+    """Ответ, который дописывается в одно сообщение по мере генерации.
+
+    Сначала отправляется заглушка, затем фоновая задача правит ее текущим
+    текстом, но не чаще раза в edit_interval секунд и только если текст
+    вырос на min_chars символов (Telegram ограничивает частоту правок и
+    отвечает 429 с retry_after, который тоже учитывается). Промежуточные
+    правки идут простым текстом: недописанная разметка могла бы не
+    разобраться. finish() выводит окончательный HTML текст.
+    """
+
+    def __init__(self, bot: Bot, chat_id: int, edit_interval: float = 1.0, min_chars: int = 40):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.edit_interval = edit_interval
+        self.min_chars = min_chars
+        self.text = ""
+        self.edits = 0
+        self.message = None
+        self._shown = 0
+        self._next_edit = 0.0
+        self._dirty = asyncio.Event()
+        self._editor: Optional[asyncio.Task] = None
+
+    async def start(self, placeholder: str, **kwargs):
+        self.message = await self.bot.send_message(self.chat_id, placeholder, **kwargs)
+        self._next_edit = asyncio.get_running_loop().time() + self.edit_interval
+        self._editor = asyncio.create_task(self._edit_loop())
+
+    def append(self, piece: str):
+        self.text += piece
+        if len(self.text) - self._shown >= self.min_chars:
+            self._dirty.set()
+
+    async def consume(self, pieces: AsyncIterator[str]) -> str:
+        """Дописывает все фрагменты потока и возвращает полный текст"""
+        async for piece in pieces:
+            self.append(piece)
+        return self.text
+
+    def _preview(self) -> str:
+        if len(self.text) < MESSAGE_LIMIT:
+            return self.text + " ▌"
+        return self.text[:MESSAGE_LIMIT - 2] + " …"
+
+    async def _wait_turn(self):
+        delay = self._next_edit - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _edit(self, text: str, parse_mode: Optional[str] = None) -> bool:
+        """Правка сообщения: False - Telegram просит подождать retry_after.
+
+        Прочие TelegramBadRequest (сообщение нельзя править, ошибка разметки)
+        пробрасываются: повтор той же правки не поможет.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            await self.bot.edit_message_text(
+                text=text,
+                chat_id=self.chat_id,
+                message_id=self.message.message_id,
+                parse_mode=parse_mode
+            )
+            self.edits += 1
+            return True
+        except TelegramRetryAfter as e:
+            self._next_edit = loop.time() + e.retry_after
+            return False
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return True
+            raise
+        finally:
+            self._next_edit = max(self._next_edit, loop.time() + self.edit_interval)
+
+    async def _edit_loop(self):
+        while True:
+            await self._dirty.wait()
+            await self._wait_turn()
+            self._dirty.clear()
+            shown = len(self.text)
+            try:
+                edited = await self._edit(self._preview())
+            except TelegramBadRequest as e:
+                logger.warning(f"Streaming edits stopped: {e}")
+                return
+            if edited:
+                self._shown = shown
+            else:
+                self._dirty.set()  # повторим после retry_after
+
+    async def _send(self, text: str, parse_mode: Optional[str] = None, **kwargs):
+        try:
+            await self.bot.send_message(self.chat_id, text, parse_mode=parse_mode, **kwargs)
+        except TelegramBadRequest as e:
+            if parse_mode is None:
+                raise
+            logger.warning(f"Sending without parse mode: {e}")
+            await self.bot.send_message(self.chat_id, text, **kwargs)
+
+    async def finish(self, text: str, parse_mode: Optional[str] = None, **kwargs):
+        """Окончательный текст: правка заглушки и, если не влезло, новые сообщения.
+
+        Если заглушку править не удалось, текст отправляется новыми
+        сообщениями, а заглушка удаляется. kwargs (например reply_markup)
+        передаются последнему новому сообщению - обычную клавиатуру к
+        правке сообщения Telegram не принимает.
+        """
+        if self._editor is not None:
+            self._editor.cancel()
+            await asyncio.gather(self._editor, return_exceptions=True)
+        parts = split_message(text)
+        edited = False
+        if self.message is not None:
+            try:
+                for attempt in range(3):
+                    await self._wait_turn()
+                    if await self._edit(parts[0], parse_mode=parse_mode):
+                        edited = True
+                        break
+            except TelegramBadRequest as e:
+                logger.warning(f"Final edit failed, sending a new message: {e}")
+        if edited:
+            parts = parts[1:]
+        elif self.message is not None:
+            try:
+                await self.bot.delete_message(self.chat_id, self.message.message_id)
+            except TelegramBadRequest:
+                pass
+        for i, part in enumerate(parts):
+            await self._send(part, parse_mode, **(kwargs if i == len(parts) - 1 else {}))
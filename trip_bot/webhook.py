@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+import signal
+import time
+from typing import Any, Dict, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_shard_key(update: Dict[str, Any]) -> int:
+    """Чат (или пользователь) обновления: в его пределах обновления обрабатываются по порядку"""
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        sender = event.get("from") or event.get("user")
+        if sender and "id" in sender:
+            return sender["id"]
+    return update.get("update_id", 0)
+
+
+class WebhookServer:
+    """Прием обновлений Telegram по webhook на aiohttp.
+
+    Обработчик HTTP только проверяет секрет, разбирает обновление, запускает
+    его обработку отдельной задачей и сразу отвечает 200. Задачи одного чата
+    выстраиваются в цепочку (каждая ждет предыдущую), поэтому сообщения
+    пользователя обрабатываются по порядку, а долгий ответ одному чату не
+    задерживает остальные. Число принятых, но еще не обработанных обновлений ограничено
+    max_in_flight: при заполнении запрос ждет до enqueue_timeout секунд и
+    получает 503, после чего Telegram повторит доставку позже. При остановке
+    новые обновления не принимаются, а принятые дорабатываются до
+    drain_timeout секунд.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = "/webhook", secret_token: Optional[str] = None,
+                 max_in_flight: int = 100, enqueue_timeout: float = 5.0,
+                 drain_timeout: float = 30.0, record_file: Optional[str] = None):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.max_in_flight = max_in_flight
+        self.enqueue_timeout = enqueue_timeout
+        self.drain_timeout = drain_timeout
+        self.record_file = record_file
+
+        self.in_flight: Optional[asyncio.Semaphore] = None  # создается в работающем event loop
+        self.draining = False
+        self.pending = 0
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._tasks: Set[asyncio.Task] = set()
+        self._chains: Dict[int, asyncio.Task] = {}  # последняя задача каждого чата
+        self._record = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    async def start(self):
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        if self.record_file:
+            self._record = open(self.record_file, "a", encoding="utf-8")
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            return web.Response(status=401)
+        if self.draining:
+            return web.Response(status=503, text="draining")
+
+        try:
+            raw = await request.json()
+            update = Update.model_validate(raw, context={"bot": self.bot})
+        except Exception as e:
+            logger.warning(f"Bad webhook update: {e}")
+            return web.Response(status=400)
+
+        try:
+            await asyncio.wait_for(self.in_flight.acquire(), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return web.Response(status=503, text="busy")
+        if self.draining:
+            # drain() начался, пока ждали слот: воркеры могут быть уже остановлены
+            self.in_flight.release()
+            return web.Response(status=503, text="draining")
+
+        if self._record is not None:
+            self._record.write(json.dumps(raw, ensure_ascii=False) + "\n")
+        self._schedule(update_shard_key(raw), update)
+        return web.Response(status=200)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "draining": self.draining,
+            "in_flight": self.pending,
+            "chats": len(self._chains),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected
+        })
+
+    def _schedule(self, chat_key: int, update: Update):
+        previous = self._chains.get(chat_key)
+        task = asyncio.create_task(self._process(update, previous))
+        self._chains[chat_key] = task
+        self._tasks.add(task)
+        self.pending += 1
+
+        def done(task: asyncio.Task):
+            self._tasks.discard(task)
+            if self._chains.get(chat_key) is task:
+                del self._chains[chat_key]
+
+        task.add_done_callback(done)
+
+    async def _process(self, update: Update, previous: Optional[asyncio.Task]):
+        try:
+            if previous is not None:
+                # ошибки предыдущего обновления уже учтены в его задаче
+                await asyncio.gather(previous, return_exceptions=True)
+            await self.dp.feed_update(self.bot, update)
+            self.processed += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Update {update.update_id} failed: {e}")
+        finally:
+            self.pending -= 1
+            self.in_flight.release()
+
+    async def drain(self):
+        """Перестать принимать обновления и дождаться обработки принятых"""
+        self.draining = True
+        started = time.monotonic()
+        if self._tasks:
+            _, left = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            if left:
+                logger.warning(f"Webhook drain timed out, {len(left)} updates left unprocessed")
+                for task in left:
+                    task.cancel()
+                await asyncio.gather(*left, return_exceptions=True)
+            else:
+                logger.info(f"Webhook drained in {time.monotonic() - started:.1f}s")
+        if self._record is not None:
+            self._record.close()
+            self._record = None
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, host: str, port: int, server: WebhookServer,
+                      public_url: Optional[str] = None, max_connections: int = 40):
+    """Запуск webhook сервера до SIGINT/SIGTERM с корректной остановкой.
+
+    public_url - внешний адрес, который регистрируется в Telegram через
+    setWebhook; без него сервер только слушает порт (локальная проверка
+    POST запросами с записанными обновлениями).
+    """
+    workflow_data = {**dp.workflow_data, "bot": bot, "dispatcher": dp}
+    await server.start()
+    await dp.emit_startup(**workflow_data)
+
+    runner = web.AppRunner(server.make_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Webhook listening on {host}:{port}{server.path} (max {server.max_in_flight} in flight)")
+
+    if public_url:
+        await bot.set_webhook(
+            url=public_url.rstrip("/") + server.path,
+            secret_token=server.secret_token,
+            max_connections=max_connections,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Webhook stopping...")
+        await server.drain()
+        await runner.cleanup()
+        await dp.emit_shutdown(**workflow_data)
+        await bot.session.close()